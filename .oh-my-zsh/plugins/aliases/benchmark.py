@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Benchmark cheatsheet.py and termcolor.py against synthetic alias dumps.
+
+Dumps of the given sizes are generated in the format of the zsh `alias`
+builtin, with quoted values, `'\\''` escapes and `=` inside values, from a
+fixed seed so that two revisions of the plugin see the same aliases:
+
+    python3 benchmark.py --output before.json
+    python3 benchmark.py --sizes 10000 --filter 'git OR docker'
+
+For every dump, the parsing and grouping of the dump as als reads it from
+stdin, the same aliases loaded from a warm --cache-dir, the keyword search als
+runs on them, the grouping done by cheatsheet(), a filtered pretty_print() into
+a buffer and termcolor.colored() over every alias line are timed separately,
+--runs times each, and the wall time percentiles are reported as JSON.
+"""
+
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import cheatsheet
+import termcolor
+
+# commands the synthetic aliases expand to, the first ones more often
+COMMANDS = ['git', 'docker', 'kubectl', 'ls', 'grep', 'cd', 'npm', 'python3', 'ssh', 'systemctl',
+            'apt', 'tmux', 'vim', 'less', 'find', 'rsync', 'curl', 'make', 'cargo', 'go', 'terraform',
+            'journalctl', 'tar', 'du', 'ps', 'kill', 'pip', 'yarn', 'helm', 'aws']
+SUBCOMMANDS = ['status', 'log', 'push', 'pull', 'run', 'exec', 'get', 'describe', 'install', 'list',
+               'show', 'diff', 'commit', 'checkout', 'build', 'test', 'restart', 'logs', 'apply', 'rm']
+OPTIONS = ['-la', '-v', '-f', '-n 20', '--all', '--force', '--color=auto', '--oneline', '--since=1.week',
+           '--format=%h %s', '--exclude-dir={.git,.svn}', '-o wide', '--namespace=default', '--prune']
+ENVIRONMENT = ['LESS=FRX', 'LANG=C', 'PAGER=cat', 'DEBUG=1', 'GIT_PAGER=less']
+
+
+def quote(value):
+    """value as printed by the alias builtin of zsh"""
+    if value and all(char.isalnum() or char in '-_./' for char in value):
+        return value
+    return "'%s'" % value.replace("'", "'\\''")
+
+
+def expansion(rng):
+    words = []
+    if rng.random() < 0.1:
+        words.append(rng.choice(ENVIRONMENT))
+    # a few commands get most of the aliases, like real alias sets
+    words.append(COMMANDS[min(int(rng.expovariate(0.25)), len(COMMANDS) - 1)])
+    if rng.random() < 0.6:
+        words.append(rng.choice(SUBCOMMANDS))
+    words.extend(rng.sample(OPTIONS, rng.randint(0, 3)))
+    if rng.random() < 0.1:
+        words.append("'%s'" % rng.choice(SUBCOMMANDS))
+    if rng.random() < 0.15:
+        words.extend(['|', 'grep', '-i', rng.choice(SUBCOMMANDS)])
+    if rng.random() < 0.05:
+        words.extend(['&&', 'echo', '"done: $?"'])
+    return ' '.join(words)
+
+
+def alias_dump(count, seed=0):
+    """count lines of `alias` output"""
+    rng = random.Random(seed)
+    lines = []
+    for index in range(count):
+        name = '%s%d' % (''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(1, 4))), index)
+        lines.append('%s=%s' % (name, quote(expansion(rng))))
+    return lines
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    rank = (len(values) - 1) * fraction
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def measure(function, runs, warmup):
+    times = []
+    for run in range(warmup + runs):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        if run >= warmup:
+            times.append(elapsed * 1000)
+    return dict(
+        p50_ms=round(percentile(times, 0.5), 3),
+        p95_ms=round(percentile(times, 0.95), 3),
+    )
+
+
+def benchmark(lines, keywords, runs, warmup):
+    data = ('\n'.join(lines) + '\n').encode('utf-8')
+    exps = [ cheatsheet.parse(line) for line in data.decode('utf-8', 'replace').splitlines() ]
+    sheet = cheatsheet.cheatsheet(lines)
+    wfilter = cheatsheet.AliasFilter(keywords)
+    aliases = [ alias for group in sheet.values() for alias in group ]
+    texts = [ '\t%s = %s' % alias[0:2] for alias in aliases ]
+    cache_dir = tempfile.mkdtemp(prefix='als-benchmark-')
+
+
+    def print_filtered():
+        cheatsheet.pretty_print(sheet, wfilter, stream=io.StringIO())
+
+    def color_lines():
+        for text in texts:
+            termcolor.colored(text, 'green')
+
+    colored = measure(color_lines, runs, warmup)
+    colored['lines_per_s'] = int(len(texts) / (colored['p50_ms'] / 1000)) if colored['p50_ms'] else None
+    try:
+        # the first load writes the cache, the measured ones read it back
+        cheatsheet.load_aliases(data, cache_dir)
+        cached = measure(lambda: cheatsheet.load_aliases(data, cache_dir), runs, warmup)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return dict(
+        lines=len(lines),
+        groups=len(sheet),
+        matches=sum(1 for alias in aliases if wfilter.match('%s\0%s' % alias[0:2]) is not None),
+        parse=measure(lambda: cheatsheet.load_aliases(data), runs, warmup),
+        cached_parse=cached,
+        search=measure(lambda: cheatsheet.search(exps, wfilter), runs, warmup),
+        cheatsheet=measure(lambda: cheatsheet.cheatsheet(lines), runs, warmup),
+        pretty_print=measure(print_filtered, runs, warmup),
+        colored=colored,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark cheatsheet.py and termcolor.py against synthetic alias dumps.")
+    parser.add_argument('--sizes', default='100,1000,10000,100000', help="comma separated alias counts")
+    parser.add_argument('--filter', default='git', help="keywords of the filtered pretty_print, as given to als")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the generated aliases")
+    parser.add_argument('--runs', type=int, default=20, help="measured runs per benchmark")
+    parser.add_argument('--warmup', type=int, default=2, help="unmeasured runs per benchmark")
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(',') if size]:
+        print('measuring %d aliases' % size, file=sys.stderr)
+        result = benchmark(alias_dump(size, args.seed), args.filter.split(), args.runs, args.warmup)
+        results.append(result)
+
+    report = dict(
+        filter=args.filter,
+        seed=args.seed,
+        colors=not termcolor.DISABLED,
+        python=platform.python_version(),
+        results=results,
+    )
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
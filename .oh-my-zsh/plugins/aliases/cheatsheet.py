@@ -1,20 +1,159 @@
 #!/usr/bin/env python3
 import sys
+import os
+import re
+import shlex
 import itertools
 import termcolor
 import argparse
 
+# bump when the layout of the pickled aliases changes
+CACHE_VERSION = 5
+# parsed alias sets kept in the cache directory
+CACHE_KEEP = 4
+TOKEN_RE = re.compile(r'[A-Za-z0-9_]+')
+# fuzzy hits printed by default
+FUZZY_LIMIT = 20
+# keywords combining the phrases of a filter, NOT binds tighter than AND, AND tighter than OR
+FILTER_OPERATORS = ('AND', 'OR', 'NOT')
+
+GROUP_STYLE = termcolor.Style('red')
+ALIAS_STYLE = termcolor.Style('green')
+HIGHLIGHT_STYLE = termcolor.Style('yellow')
+
+# alias files of the dotfiles read by --sources, relative to the home directory
+SHELL_SOURCES = ['.bash_aliases.dist', '.shellrc/rc.d/alias.sh', '.shellrc/zshrc.d/02_alias.zsh']
+GIT_SOURCES = ['.gitconfig_alias']
+# aliases parsed from each source file, with the mtime and size they were parsed at
+SOURCES_CACHE = 'sources.pickle'
+SHELL_ALIAS_RE = re.compile(r'^\s*alias\s+(.*)$')
+
 def parse(line):
     left = line[0:line.find('=')].strip()
     right = line[line.find('=')+1:].strip('\'"\n ')
+    return expansion(left, right)
+
+def expansion(left, right):
     try:
         cmd = next(part for part in right.split() if len([char for char in '=<>' if char in part])==0)
     except StopIteration:
         cmd = right
     return (left, right, cmd)
 
+def parse_shell_aliases(text):
+    """(name, value) of every `alias name=value ...` command of a shell script"""
+    aliases = []
+    for line in text.splitlines():
+        match = SHELL_ALIAS_RE.match(line)
+        if not match:
+            continue
+        try:
+            words = shlex.split(match.group(1), comments=True)
+        except ValueError:
+            continue  # quotes spanning several lines
+        for word in words:
+            # options such as -g, and `alias name` queries
+            if word.startswith('-') or '=' not in word:
+                continue
+            aliases.append(tuple(word.split('=', 1)))
+    return aliases
+
+def git_config_value(raw):
+    value, quoted, escaped = [], False, False
+    for char in raw:
+        if escaped:
+            value.append({'n': '\n', 't': '\t', 'b': '\b'}.get(char, char))
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif char in '#;' and not quoted:
+            break
+        else:
+            value.append(char)
+    return ''.join(value).strip()
+
+def parse_git_aliases(text):
+    """(name, value) of the [alias] section of a git config file, named `git <alias>`"""
+    aliases = []
+    section = None
+    # a backslash at the end of a line continues the value on the next one
+    for line in re.sub(r'\\\n', '', text).splitlines():
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
+        if line.startswith('['):
+            section = line[1:line.find(']')].strip().lower()
+            continue
+        if section != 'alias' or '=' not in line:
+            continue
+        name, raw = line.split('=', 1)
+        value = git_config_value(raw)
+        aliases.append(('git ' + name.strip(), value[1:] if value.startswith('!') else 'git ' + value))
+    return aliases
+
+def alias_sources(home, omz=None, omz_custom=None, plugins=()):
+    """(path, kind) of the files --sources reads, kind being 'shell' or 'git'"""
+    sources = [ (os.path.join(home, name), 'shell') for name in SHELL_SOURCES ]
+    sources += [ (os.path.join(home, name), 'git') for name in GIT_SOURCES ]
+    for plugin in plugins:
+        # like oh-my-zsh, a custom plugin replaces the bundled one
+        for top in (omz_custom, omz):
+            path = os.path.join(top or '', 'plugins', plugin, plugin + '.plugin.zsh')
+            if top and os.path.isfile(path):
+                sources.append((path, 'shell'))
+                break
+    return sources
+
+def load_sources(sources, cache_dir=None):
+    """(name, value) of the aliases defined by sources, the last definition of a name winning
+
+    Files whose mtime and size did not change since the last run are not parsed again.
+    """
+    import pickle
+    cache = {}
+    cache_path = os.path.join(cache_dir, SOURCES_CACHE) if cache_dir else None
+    if cache_path:
+        try:
+            with open(cache_path, 'rb') as f:
+                cache = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+            pass
+    changed = False
+    aliases = {}
+    for path, kind in sources:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        key = (st.st_mtime_ns, st.st_size)
+        entry = cache.get(path)
+        if entry is None or entry[0] != key:
+            try:
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    text = f.read()
+            except (IOError, OSError):
+                continue
+            entry = cache[path] = (key, parse_git_aliases(text) if kind == 'git' else parse_shell_aliases(text))
+            changed = True
+        aliases.update(entry[1])
+    if cache_path and changed:
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            with open(cache_path + '.tmp', 'wb') as f:
+                pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(cache_path + '.tmp', cache_path)
+        except (IOError, OSError):
+            pass
+    return list(aliases.items())
+
 def cheatsheet(lines):
-    exps = [ parse(line) for line in lines ]
+    return cheatsheet_of([ parse(line) for line in lines ])
+
+def cheatsheet_of(exps):
+    exps = list(exps)
     exps.sort(key=lambda exp:exp[2])
     cheatsheet = {'_default': []}
     for key, group in itertools.groupby(exps, lambda exp:exp[2]):
@@ -28,42 +167,433 @@ def cheatsheet(lines):
         target_aliases.extend(group_list)
     return cheatsheet
 
-def pretty_print_group(key, aliases, highlight=None, only_groupname=False):
+def load_aliases(data, cache_dir=None):
+    """(aliases, cheatsheet) of the alias dump data (bytes), read from cache_dir when this exact dump was seen before
+
+    The cache file is named after a CRC of data and holds data itself, compared
+    before the cached aliases are trusted.
+    """
+    if not cache_dir:
+        exps = [ parse(line) for line in data.decode('utf-8', 'replace').splitlines() ]
+        return exps, cheatsheet_of(exps)
+    import pickle
+    import zlib
+    path = os.path.join(cache_dir, 'aliases-%08x.pickle' % zlib.crc32(data))
+    try:
+        with open(path, 'rb') as f:
+            version, cached, exps, sheet = pickle.load(f)
+        if version == CACHE_VERSION and cached == data:
+            return exps, sheet
+    except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError, TypeError):
+        pass
+    exps = [ parse(line) for line in data.decode('utf-8', 'replace').splitlines() ]
+    sheet = cheatsheet_of(exps)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(path + '.tmp', 'wb') as f:
+            # the groups hold the very tuples of exps, pickle keeps them shared
+            pickle.dump((CACHE_VERSION, data, exps, sheet), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(path + '.tmp', path)
+        olds = sorted((os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.startswith('aliases-') and name.endswith('.pickle')), key=os.path.getmtime)
+        for old in olds[:-CACHE_KEEP]:
+            os.remove(old)
+    except (IOError, OSError):
+        pass
+    return exps, sheet
+
+class AliasTrie(object):
+    """alias expansions indexed word by word, to find the alias a command line starts with
+
+    Looking a command up costs one dict access per word of the command, whatever
+    the number of aliases. Only aliases shorter than their expansion are kept,
+    and the shortest one when several expand to the same words.
+    """
+
+    def __init__(self, exps=()):
+        self.root = {}
+        for exp in exps:
+            self.add(exp)
+
+    def add(self, exp):
+        words = exp[1].split()
+        if not words or len(exp[0]) >= len(exp[1]):
+            return
+        node = self.root
+        for word in words:
+            node = node.setdefault(word, {})
+        # the None key of a node holds the alias expanding to the words leading to it
+        if None not in node or len(exp[0]) < len(node[None][0]):
+            node[None] = exp
+
+    def lookup(self, command):
+        """(alias, number of words it replaces) for the longest expansion command starts with, (None, 0) without one"""
+        node, best = self.root, (None, 0)
+        for depth, word in enumerate(command.split(), 1):
+            node = node.get(word)
+            if node is None:
+                break
+            if None in node:
+                best = (node[None], depth)
+        return best
+
+    def expansions(self):
+        """(words of the expansion joined by one space, alias) of every alias of the trie"""
+        stack = [(self.root, [])]
+        while stack:
+            node, words = stack.pop()
+            for word, child in node.items():
+                if word is None:
+                    yield ' '.join(words), child
+                else:
+                    stack.append((child, words + [word]))
+
+class AliasFilter(object):
+    """keywords of als compiled into a single regular expression
+
+    Plain words next to each other form one phrase, matched as a substring like
+    the whole filter used to be, and phrases are combined with AND, OR and NOT
+    (a NOT after a phrase implies AND). Each phrase is an optional lookahead of
+    one pattern, so a single scan of the 'name\\0expansion' subject of an alias
+    tells which phrases it contains and where, even when one phrase starts
+    another. With regex, the keywords joined by spaces are one python regular
+    expression instead.
+
+    >>> AliasFilter(['pu', 'AND', 'push']).match('gp\\0git push')
+    [(7, 11)]
+    >>> AliasFilter(['git', 'AND', 'gi']).match('gpl\\0git pull')
+    [(4, 7)]
+    >>> AliasFilter(['gi', 'NOT', 'git']).match('gpl\\0git pull') is None
+    True
+    """
+
+    def __init__(self, keywords, regex=False):
+        self.regex = regex
+        if regex:
+            self.phrases, self.clauses = [' '.join(keywords)], [[(False, 0)]]
+            pattern = '(?P<p0>%s)' % self.phrases[0]
+        else:
+            self.phrases = []
+            self.clauses = self._parse(keywords)
+            escaped = [ re.escape(phrase) for phrase in self.phrases ]
+            if len(escaped) == 1:
+                pattern = '(?P<p0>%s)' % escaped[0]
+            else:
+                # an empty match where any phrase starts, whose groups are all the phrases starting there
+                pattern = '(?=%s)%s' % ('|'.join(escaped), ''.join('(?=(?P<p%d>%s))?' % item for item in enumerate(escaped)))
+        try:
+            self.pattern = re.compile(pattern)
+        except re.error as e:
+            raise ValueError('invalid regular expression: %s' % e)
+        self.positive = set(i for clause in self.clauses for negated, i in clause if not negated)
+
+    def _parse(self, keywords):
+        """OR clauses of (negated, phrase number) terms, all of which hold for an alias matching the clause"""
+        clauses, clause, words = [], [], []
+        negated, after_term, operator = False, False, None
+        # None closes the last clause
+        for word in list(keywords) + [None]:
+            if word is not None and word not in FILTER_OPERATORS:
+                words.append(word)
+                continue
+            if words:
+                phrase = ' '.join(words)
+                if phrase not in self.phrases:
+                    self.phrases.append(phrase)
+                clause.append((negated, self.phrases.index(phrase)))
+                words, negated, after_term = [], False, True
+            if negated or (word != 'NOT' and not after_term):
+                if negated or word is None:
+                    raise ValueError('%s must be followed by a keyword' % ('NOT' if negated else operator))
+                raise ValueError('%s must follow a keyword' % word)
+            if word == 'NOT':
+                negated = True
+            elif word is None or word == 'OR':
+                clauses.append(clause)
+                clause = []
+            operator, after_term = word, False
+        return clauses
+
+    def spans(self, text):
+        """(numbers of the phrases found in text, merged (start, end) spans of the ones not under NOT)"""
+        found, spans = set(), []
+        for match in self.pattern.finditer(text):
+            for name, value in match.groupdict().items():
+                if value is None:
+                    continue
+                i = int(name[1:])
+                found.add(i)
+                if i not in self.positive:
+                    continue
+                start, end = match.span(name)
+                if start == end:
+                    continue
+                if spans and start <= spans[-1][1]:
+                    spans[-1] = (spans[-1][0], max(end, spans[-1][1]))
+                else:
+                    spans.append((start, end))
+        return found, spans
+
+    def match(self, subject):
+        """highlight spans of subject when it satisfies the filter, None otherwise"""
+        found, spans = self.spans(subject)
+        for clause in self.clauses:
+            if all((i in found) != negated for negated, i in clause):
+                return spans
+        return None
+
+    def runs(self):
+        """alnum runs per clause, each lying inside a token of every alias matching the clause, None when a clause has none"""
+        if self.regex:
+            return None
+        runs = []
+        for clause in self.clauses:
+            words = [ run for negated, i in clause if not negated for run in TOKEN_RE.findall(self.phrases[i]) ]
+            if not words:
+                return None
+            runs.append(words)
+        return runs
+
+def search(aliases, wfilter):
+    """{alias: highlight spans in its 'name\\0expansion' subject} of the aliases matching the AliasFilter wfilter
+
+    Only the aliases containing the longest word of a clause of the filter, found
+    by a substring test, are matched against it.
+    """
+    candidates = range(len(aliases))
+    runs = wfilter.runs()
+    if runs is not None:
+        candidates = set()
+        # a word lies in the name or in the expansion, never across the NUL between them
+        for run in [ max(words, key=len) for words in runs ]:
+            candidates.update([ i for i, alias in enumerate(aliases) if run in alias[1] or run in alias[0] ])
+    matches = {}
+    for i in candidates:
+        spans = wfilter.match('%s\0%s' % aliases[i][0:2])
+        if spans is not None:
+            matches[aliases[i]] = spans
+    return matches
+
+def trigrams(text):
+    text = text.lower()
+    return set(text[i:i+3] for i in range(len(text) - 2))
+
+def edit_distance(a, b):
+    """Levenshtein distance, a transposition of two adjacent characters counting as one edit"""
+    before, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j-1] + 1, previous[j-1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j-2] and a[i-2] == cb:
+                cost = min(cost, before[j-2] + 1)
+            current.append(cost)
+        before, previous = previous, current
+    return previous[-1]
+
+def fuzzy_score(alias, query, shared, ngrams):
+    name, right = alias[0].lower(), alias[1].lower()
+    score = 0
+    if name == query:
+        score += 100
+    elif name.startswith(query):
+        score += 50
+    elif right.startswith(query):
+        score += 30
+    for text in (name, right):
+        pos = text.find(query)
+        if pos > -1:
+            # a match starting a word beats one inside a word
+            score += 20 if pos == 0 or not text[pos-1].isalnum() else 10
+            break
+    if ngrams:
+        score += 20.0 * shared / ngrams
+    # typos in the alias name, about one per three characters
+    typos = max(1, len(query) // 3)
+    if abs(len(name) - len(query)) <= typos:
+        distance = edit_distance(query, name)
+        if distance <= typos:
+            score += 10 * (typos + 1 - distance) / (typos + 1)
+    return score
+
+def fuzzy_search(aliases, query, limit=FUZZY_LIMIT):
+    """(score, alias) of the limit best matches of query among aliases, best first
+
+    The few trigrams of the query are looked for as substrings of each alias:
+    no trigram index of the aliases is built or kept.
+    """
+    query = query.lower()
+    qgrams = trigrams(query)
+    shared = {}
+    for i, alias in enumerate(aliases):
+        text = (alias[0] + ' ' + alias[1]).lower()
+        count = len([ gram for gram in qgrams if gram in text ])
+        if count:
+            shared[i] = count
+    # aliases sharing less than half the trigrams of the best one would not make it to the top
+    best = max(shared.values()) if shared else 0
+    candidates = [ i for i, count in shared.items() if 2 * count >= best ]
+    if len(candidates) < limit:
+        # too few aliases share trigrams with the query: rank them all on the other criteria
+        candidates = range(len(aliases))
+    hits = [ (fuzzy_score(aliases[i], query, shared.get(i, 0), len(qgrams)), aliases[i]) for i in candidates ]
+    hits.sort(key=lambda hit: (-hit[0], len(hit[1][1]), hit[1][0]))
+    return [ hit for hit in hits[:limit] if hit[0] > 0 ]
+
+def write_output(text, stream=None):
+    """write text at once, through $PAGER when it is taller than the terminal"""
+    stream = stream or sys.stdout
+    if stream.isatty():
+        try:
+            rows = os.get_terminal_size(stream.fileno()).lines
+        except OSError:
+            rows = 0
+        if rows and text.count('\n') >= rows:
+            # like git: without $LESS, let less pass colors through and quit on short output
+            env = dict(os.environ)
+            env.setdefault('LESS', 'FRX')
+            import subprocess
+            try:
+                pager = subprocess.Popen(shlex.split(os.getenv('PAGER') or 'less'), stdin=subprocess.PIPE, env=env)
+            except (OSError, ValueError):
+                pager = None
+            if pager is not None:
+                try:
+                    pager.stdin.write(text.encode('utf-8', 'replace'))
+                    pager.stdin.close()
+                except BrokenPipeError:
+                    pass  # quit before reading everything
+                while True:
+                    try:
+                        pager.wait()
+                        return
+                    except KeyboardInterrupt:
+                        pass  # the pager handles ^C itself
+    stream.write(text)
+    stream.flush()
+
+def highlighted(text, spans, style, offset=0):
+    """text with the parts at spans - offset highlighted, spans outside of text are ignored"""
+    parts, last = [], 0
+    for start, end in spans:
+        start, end = max(start - offset, last), min(end - offset, len(text))
+        if start >= end:
+            continue
+        # close the surrounding style around each highlighted occurrence, then reopen it
+        parts.extend((text[last:start], style.suffix, HIGHLIGHT_STYLE(text[start:end]), style.prefix))
+        last = end
+    parts.append(text[last:])
+    return ''.join(parts)
+
+def render_group(out, key, aliases, wfilter=None, only_groupname=False, matches=None):
+    """append the group to out, highlighting what the AliasFilter wfilter matches
+
+    matches maps aliases to their spans as returned by search(), they are
+    matched again when missing.
+    """
     if len(aliases) == 0:
         return
-    group_hl_formatter = lambda g, hl: termcolor.colored(hl, 'yellow').join([termcolor.colored(part, 'red') for part in ('[%s]' % g).split(hl)])
-    alias_hl_formatter = lambda alias, hl: termcolor.colored(hl, 'yellow').join([termcolor.colored(part, 'green') for part in ('\t%s = %s' % alias[0:2]).split(hl)])
-    group_formatter = lambda g: termcolor.colored('[%s]' % g, 'red')
-    alias_formatter = lambda alias: termcolor.colored('\t%s = %s' % alias[0:2], 'green')
-    if highlight and len(highlight)>0:
-        print (group_hl_formatter(key, highlight))
-        if not only_groupname:
-            print ('\n'.join([alias_hl_formatter(alias, highlight) for alias in aliases]))
+    header = '[%s]' % key
+    if not wfilter:
+        lines = [] if only_groupname else [ '\t%s = %s' % alias[0:2] for alias in aliases ]
     else:
-        print (group_formatter(key))
-        if not only_groupname:
-            print ('\n'.join([alias_formatter(alias) for alias in aliases]))
-    print ('')
+        header = '[%s]' % highlighted(key, wfilter.spans(key)[1], GROUP_STYLE)
+        lines = []
+        for alias in aliases:
+            spans = matches[alias] if matches is not None else wfilter.match('%s\0%s' % alias[0:2])
+            name_len = len(alias[0]) + 1
+            lines.append('\t%s = %s' % (highlighted(alias[0], spans, ALIAS_STYLE), highlighted(alias[1], spans, ALIAS_STYLE, name_len)))
+    out.append(GROUP_STYLE(header) + '\n')
+    if lines:
+        out.append('\n'.join(termcolor.colorize_many(lines, ALIAS_STYLE)) + '\n')
+    out.append('\n')
+
+def pretty_print_ranked(cheatsheet, hits):
+    groups = dict((alias, key) for key, aliases in cheatsheet.items() for alias in aliases)
+    group, alias_style, reset = GROUP_STYLE.prefix, ALIAS_STYLE.prefix, GROUP_STYLE.suffix
+    write_output(''.join([ '%s[%s]%s%s\t%s = %s%s\n' % (group, groups.get(alias, '_default'), reset, alias_style, alias[0], alias[1], reset) for score, alias in hits ]))
+
+def pretty_print_group(key, aliases, highlight=None, only_groupname=False):
+    out = []
+    render_group(out, key, aliases, as_filter(highlight), only_groupname)
+    write_output(''.join(out))
+
+def as_filter(wfilter):
+    """AliasFilter of wfilter, which may also be a plain substring"""
+    if not wfilter or isinstance(wfilter, AliasFilter):
+        return wfilter
+    return AliasFilter([wfilter])
 
-def pretty_print(cheatsheet, wfilter, group_list=None, groups_only=False):
+def pretty_print(cheatsheet, wfilter, group_list=None, groups_only=False, matches=None, stream=None):
+    """print the groups of cheatsheet, only the aliases matching wfilter (a substring or an AliasFilter) with one
+
+    matches are the aliases found by search() for wfilter, when already known.
+    """
+    wfilter = as_filter(wfilter)
+    if wfilter and matches is None:
+        matches = search([ alias for aliases in cheatsheet.values() for alias in aliases ], wfilter)
+    out = []
     sorted_key = sorted(cheatsheet.keys())
     for key in sorted_key:
         if group_list and key not in group_list:
             continue
         aliases = cheatsheet.get(key)
         if not wfilter:
-            pretty_print_group(key, aliases, wfilter, groups_only)
+            render_group(out, key, aliases, wfilter, groups_only)
         else:
-            pretty_print_group(key, [ alias for alias in aliases if alias[0].find(wfilter)>-1 or alias[1].find(wfilter)>-1], wfilter)
+            render_group(out, key, [ alias for alias in aliases if alias in matches ], wfilter, matches=matches)
+    write_output(''.join(out), stream)
 
-if __name__ == '__main__':
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Pretty print aliases.", prog="als")
-    parser.add_argument('filter', nargs="*", metavar="<keyword>", help="search aliases matching keywords")
+    parser.add_argument('filter', nargs="*", metavar="<keyword>", help="search aliases matching keywords, combined with AND, OR and NOT")
+    parser.add_argument('-e', '--regex', action='store_true', help="the keywords are a regular expression")
     parser.add_argument('-g', '--group', dest="group_list", action='append', help="only print aliases in given groups")
     parser.add_argument('--groups', dest='groups_only', action='store_true', help="only print alias groups")
-    args = parser.parse_args()
+    parser.add_argument('-f', '--fuzzy', action='store_true', help="rank aliases by similarity with the keywords")
+    parser.add_argument('-n', dest='limit', type=int, default=FUZZY_LIMIT, metavar="<count>", help="number of fuzzy matches to print (default: %(default)s)")
+    parser.add_argument('--cache-dir', metavar="<dir>", help="keep the parsed aliases, and those read by --sources, in <dir>")
+    parser.add_argument('--which', metavar="<command>", help="print the alias the command line could have started with")
+    parser.add_argument('--hints', action='store_true', help="print the zsh assignment of the expansion -> alias table used by the preexec hint")
+    parser.add_argument('--sources', action='store_true', help="read the aliases from the dotfiles and oh-my-zsh plugins instead of stdin")
+    parser.add_argument('--home', default=os.path.expanduser('~'), metavar="<dir>", help="where the dotfiles are (default: ~)")
+    parser.add_argument('--omz', metavar="<dir>", help="oh-my-zsh directory (default: $ZSH)")
+    parser.add_argument('--omz-custom', metavar="<dir>", help="oh-my-zsh custom directory (default: $ZSH_CUSTOM)")
+    parser.add_argument('--plugins', default='', metavar="<names>", help="space separated oh-my-zsh plugins whose aliases --sources reads")
+    args = parser.parse_args(argv)
 
-    lines = sys.stdin.readlines()
+    if args.sources:
+        omz = args.omz or os.getenv('ZSH') or os.path.join(args.home, '.oh-my-zsh')
+        omz_custom = args.omz_custom or os.getenv('ZSH_CUSTOM') or os.path.join(omz, 'custom')
+        sources = alias_sources(args.home, omz, omz_custom, args.plugins.split())
+        exps = [ expansion(name, value) for name, value in load_sources(sources, args.cache_dir) ]
+        sheet = cheatsheet_of(exps)
+    else:
+        exps, sheet = load_aliases(sys.stdin.buffer.read(), args.cache_dir)
     group_list = args.group_list or None
     wfilter = " ".join(args.filter) or None
-    pretty_print(cheatsheet(lines), wfilter, group_list, args.groups_only)
+    if args.which is not None:
+        alias, depth = AliasTrie(exps).lookup(args.which)
+        if alias is None:
+            return 1
+        write_output(' '.join([alias[0]] + args.which.split()[depth:]) + '\n')
+        return 0
+    if args.hints:
+        pairs = sorted(AliasTrie(exps).expansions())
+        write_output('_ALS_HINTS=(\n%s)\n' % ''.join('  %s %s\n' % (shlex.quote(words), shlex.quote(alias[0])) for words, alias in pairs))
+        return 0
+    if args.fuzzy and wfilter:
+        pretty_print_ranked(sheet, fuzzy_search(exps, wfilter, args.limit))
+        return 0
+    matches = None
+    if wfilter:
+        try:
+            wfilter = AliasFilter(args.filter, args.regex)
+        except ValueError as e:
+            parser.error(str(e))
+        matches = search(exps, wfilter)
+    pretty_print(sheet, wfilter, group_list, args.groups_only, matches)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -27,7 +27,7 @@ from __future__ import print_function
 import os
 
 
-__ALL__ = [ 'colored', 'cprint' ]
+__ALL__ = [ 'colored', 'cprint', 'Style', 'colorize_many' ]
 
 VERSION = (1, 1, 0)
 
@@ -82,6 +82,57 @@ COLORS = dict(
 
 RESET = '\033[0m'
 
+# Colors are off when set, read from $ANSI_COLORS_DISABLED once at import;
+# assign to it to switch colors on or off afterwards.
+DISABLED = os.getenv('ANSI_COLORS_DISABLED') is not None
+
+
+class Style(object):
+    """Color, highlight and attributes resolved once into a prefix/suffix pair.
+
+    Example:
+        error = Style('red', attrs=['bold'])
+        print(error('Failed'))
+        print(error.prefix + 'Failed' + error.suffix)
+    """
+
+    __slots__ = ('_prefix',)
+
+    def __init__(self, color=None, on_color=None, attrs=None):
+        # same nesting as colored(): attributes outermost, then highlight, then color
+        codes = [ATTRIBUTES[attr] for attr in reversed(attrs or [])]
+        if on_color is not None:
+            codes.append(HIGHLIGHTS[on_color])
+        if color is not None:
+            codes.append(COLORS[color])
+        self._prefix = ''.join('\033[%dm' % code for code in codes)
+
+    @property
+    def prefix(self):
+        return '' if DISABLED else self._prefix
+
+    @property
+    def suffix(self):
+        return '' if DISABLED else RESET
+
+    def __call__(self, text):
+        if DISABLED:
+            return text
+        return self._prefix + text + RESET
+
+
+def colorize_many(iterable, style):
+    """Colorize every text of iterable with style, a Style or a color name.
+
+    Returns a list.
+    """
+    if not isinstance(style, Style):
+        style = Style(style)
+    if DISABLED:
+        return list(iterable)
+    prefix, suffix = style.prefix, style.suffix
+    return [prefix + text + suffix for text in iterable]
+
 
 def colored(text, color=None, on_color=None, attrs=None):
     """Colorize text.
@@ -99,7 +150,7 @@ def colored(text, color=None, on_color=None, attrs=None):
         colored('Hello, World!', 'red', 'on_grey', ['blue', 'blink'])
         colored('Hello, World!', 'green')
     """
-    if os.getenv('ANSI_COLORS_DISABLED') is None:
+    if not DISABLED:
         fmt_str = '\033[%dm%s'
         if color is not None:
             text = fmt_str % (COLORS[color], text)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""Benchmark the git-prompt status script against synthetic repositories.
+
+Repositories are generated once under --workdir and reused by later runs, so
+that the numbers of two revisions of gitstatus.py can be compared:
+
+    python3 benchmark.py --output before.json
+    python3 benchmark.py --script /path/to/other/gitstatus.py --output after.json
+
+For every scenario the script is run --runs times from the repository root and
+the wall time percentiles, the number of git processes it started per run and
+the peak resident set size of the run are reported as JSON.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+GIT_ENV = dict(
+    os.environ,
+    GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@example.com',
+    GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@example.com',
+    GIT_CONFIG_NOSYSTEM='1', LANG='C',
+)
+
+FILES_PER_DIR = 100
+
+
+def git(repo, *args):
+    subprocess.check_call(['git', '-c', 'gc.auto=0', '-c', 'protocol.file.allow=always'] + list(args),
+                          cwd=repo, env=GIT_ENV, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def file_path(repo, index):
+    return os.path.join(repo, 'd%04d' % (index // FILES_PER_DIR), 'f%06d.txt' % index)
+
+
+def write_files(repo, count, start=0, content='line\n', mode='w'):
+    for index in range(start, start + count):
+        path = file_path(repo, index)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, mode) as f:
+            f.write(content)
+
+
+def build_repository(path, files, dirty=0.0, untracked=0.0, tags=0, detached=False, stashes=0, submodules=0):
+    """create a repository with `files` tracked files and the given working tree state"""
+    os.makedirs(path)
+    git(path, 'init', '-q', '-b', 'main')
+    write_files(path, files)
+    git(path, 'add', '-A')
+    git(path, 'commit', '-q', '-m', 'initial')
+
+    for index in range(stashes):
+        write_files(path, 1, index % files, 'stash %d\n' % index, 'a')
+        git(path, 'stash', 'push', '-q', '-m', 'stash %d' % index)
+
+    for index in range(submodules):
+        sub = path + '-sub%d' % index
+        build_repository(sub, 10)
+        git(path, 'submodule', 'add', '-q', sub, 'sub%d' % index)
+    if submodules:
+        git(path, 'commit', '-q', '-m', 'submodules')
+        write_files(os.path.join(path, 'sub0'), 1, 0, 'dirty\n', 'a')
+
+    for index in range(tags):
+        if index % 2:
+            git(path, 'tag', 'v1.%d' % index)
+        else:
+            git(path, 'tag', '-a', '-m', 'release', 'v1.%d' % index)
+    if detached:
+        git(path, 'checkout', '-q', '--detach', 'HEAD')
+
+    # modified tracked files, then untracked files spread over the tracked directories
+    write_files(path, int(files * dirty), 0, 'dirty\n', 'a')
+    for index in range(int(files * untracked)):
+        with open(os.path.join(path, 'd%04d' % (index % max(1, files // FILES_PER_DIR)), 'u%06d.txt' % index), 'w') as f:
+            f.write('untracked\n')
+
+
+def scenarios(sizes):
+    for files in sizes:
+        label = '%dk' % (files // 1000) if files >= 1000 else str(files)
+        yield label + '-clean', dict(files=files)
+        yield label + '-dirty1-untracked1', dict(files=files, dirty=0.01, untracked=0.01)
+        yield label + '-dirty10-untracked10', dict(files=files, dirty=0.1, untracked=0.1)
+    files = min(sizes)
+    yield 'detached-tags', dict(files=files, tags=20, detached=True)
+    yield 'stash-50', dict(files=files, stashes=50)
+    yield 'submodules-5', dict(files=files, submodules=5)
+
+
+def make_git_shim(workdir):
+    """put a git wrapper counting its invocations first in PATH"""
+    shim_dir = os.path.join(workdir, 'shim')
+    counter = os.path.join(workdir, 'git-forks')
+    real_git = shutil.which('git')
+    if not os.path.isdir(shim_dir):
+        os.makedirs(shim_dir)
+    shim = os.path.join(shim_dir, 'git')
+    with open(shim, 'w') as f:
+        f.write('#!/bin/sh\necho >> "%s"\nexec "%s" "$@"\n' % (counter, real_git))
+    os.chmod(shim, 0o755)
+    return shim_dir, counter
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    rank = (len(values) - 1) * fraction
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def measure(script, repo, args, runs, warmup, shim_dir, counter):
+    env = dict(os.environ, PATH=shim_dir + os.pathsep + os.environ.get('PATH', ''))
+    times, forks, rss = [], [], []
+    for run in range(warmup + runs):
+        open(counter, 'w').close()
+        started = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, script] + args, cwd=repo, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - started
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if run < warmup:
+            continue
+        times.append(elapsed * 1000)
+        with open(counter) as f:
+            forks.append(sum(1 for _ in f))
+        rss.append(usage.ru_maxrss)
+    return dict(
+        p50_ms=round(percentile(times, 0.5), 2),
+        p95_ms=round(percentile(times, 0.95), 2),
+        git_forks=max(forks),
+        peak_rss_kb=max(rss),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark gitstatus.py against synthetic repositories.")
+    parser.add_argument('--script', default=os.path.join(HERE, 'gitstatus.py'), help="status script to measure")
+    parser.add_argument('--args', default='', help="extra arguments for the status script, e.g. '--branch-only'")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'gitstatus-bench'),
+                        help="where the synthetic repositories are kept between runs")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="comma separated tracked file counts")
+    parser.add_argument('--only', help="comma separated scenario names to run")
+    parser.add_argument('--runs', type=int, default=20, help="measured runs per scenario")
+    parser.add_argument('--warmup', type=int, default=2, help="unmeasured runs per scenario")
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    only = set(args.only.split(',')) if args.only else None
+    script = os.path.abspath(args.script)
+    shim_dir, counter = make_git_shim(args.workdir)
+
+    results = []
+    for name, spec in scenarios(sizes):
+        if only and name not in only:
+            continue
+        repo = os.path.join(args.workdir, 'repos', name)
+        if not os.path.isdir(repo):
+            print('generating %s' % name, file=sys.stderr)
+            build_repository(repo, **spec)
+        print('measuring %s' % name, file=sys.stderr)
+        result = dict(scenario=name, runs=args.runs, **spec)
+        result.update(measure(script, repo, args.args.split(), args.runs, args.warmup, shim_dir, counter))
+        results.append(result)
+
+    report = dict(
+        script=script,
+        args=args.args,
+        python=platform.python_version(),
+        git=subprocess.check_output(['git', '--version']).decode().strip(),
+        results=results,
+    )
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""Read refs, config and reflogs straight from a git directory, without forking git.
+
+Only what the prompt needs is covered: HEAD, loose and packed refs, branch
+upstreams from the repository config (include directives are not followed),
+the stash reflog, the tags pointing at a commit and the operation in progress. Functions return None when
+the answer cannot be found from the files alone, callers then ask git.
+"""
+
+import os
+import re
+import zlib
+
+
+def read_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def read_head(repo):
+    """return (symbolic ref or None, oid or None) of the HEAD of repo"""
+    content = read_file(os.path.join(repo.gitdir, 'HEAD'))
+    if content is None:
+        return None, None
+    content = content.decode('utf-8', 'surrogateescape').strip()
+    if content.startswith('ref: '):
+        ref = content[len('ref: '):]
+        return ref, resolve_ref(repo, ref)
+    return None, content
+
+
+def packed_refs(repo):
+    """return {refname: (oid, peeled oid or None when unknown)} from the packed-refs file of repo"""
+    refs = {}
+    content = read_file(os.path.join(repo.commondir, 'packed-refs'))
+    if not content:
+        return refs
+    last = None
+    peeled_traits = False
+    for line in content.decode('utf-8', 'surrogateescape').splitlines():
+        if not line:
+            continue
+        if line[0] == '#':
+            # with the peeled trait, tags without a ^ line are not annotated
+            peeled_traits = peeled_traits or (line.startswith('# pack-refs with:') and ' peeled' in line)
+            continue
+        if line[0] == '^':
+            if last is not None:
+                refs[last] = (refs[last][0], line[1:])
+            continue
+        oid, _, last = line.partition(' ')
+        refs[last] = (oid, oid if peeled_traits and last.startswith('refs/tags/') else None)
+    return refs
+
+
+def resolve_ref(repo, ref, packed=None, depth=5):
+    """return the oid ref points to, following symbolic refs, None if it does not exist"""
+    for _ in range(depth):
+        # per-worktree refs live in the worktree git dir, shared ones in the common dir
+        content = read_file(os.path.join(repo.gitdir, ref))
+        if content is None and repo.commondir != repo.gitdir:
+            content = read_file(os.path.join(repo.commondir, ref))
+        if content is None:
+            if packed is None:
+                packed = packed_refs(repo)
+            entry = packed.get(ref)
+            return entry[0] if entry else None
+        content = content.decode('utf-8', 'surrogateescape').strip()
+        if not content.startswith('ref: '):
+            return content
+        ref = content[len('ref: '):]
+    return None
+
+
+def read_config(path):
+    """return {(section, subsection): {key: value}} of a git config file, the last value of a key wins"""
+    config = {}
+    content = read_file(path)
+    if content is None:
+        return config
+    current = None
+    for line in content.decode('utf-8', 'surrogateescape').splitlines():
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
+        if line[0] == '[':
+            header = line[1:line.find(']')]
+            section, _, subsection = header.partition(' ')
+            subsection = subsection.strip()
+            if subsection.startswith('"'):
+                subsection = subsection[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+            elif '.' in section:
+                section, subsection = section.split('.', 1)  # deprecated [section.subsection] syntax
+            current = config.setdefault((section.lower(), subsection), {})
+            continue
+        if current is None:
+            continue
+        key, sep, value = line.partition('=')
+        value = value.strip()
+        if value.startswith('"'):
+            value = value[1:value.rfind('"')]
+        else:
+            value = re.split(r'\s[#;]', value, 1)[0].strip()
+        current[key.strip().lower()] = value if sep else 'true'
+    return config
+
+
+def upstream_of(repo, branch, config=None):
+    """return (name as shown by git status, refname) of the upstream of branch, (None, None) without one"""
+    if config is None:
+        config = read_config(os.path.join(repo.commondir, 'config'))
+    section = config.get(('branch', branch), {})
+    remote, merge = section.get('remote'), section.get('merge')
+    if not remote or not merge:
+        return None, None
+    short = merge[len('refs/heads/'):] if merge.startswith('refs/heads/') else merge
+    if remote == '.':
+        return short, merge
+    # assumes the default refs/remotes/<remote>/* fetch refspec
+    return remote + '/' + short, 'refs/remotes/%s/%s' % (remote, short)
+
+
+def stash_count(repo):
+    content = read_file(os.path.join(repo.commondir, 'logs', 'refs', 'stash'))
+    return content.count(b'\n') if content else 0
+
+
+def operation_in_progress(repo):
+    """return the operation under way in the work tree of repo, '' when there is none
+
+    One of 'rebase', 'am', 'am/rebase' followed by ' <step>/<total>' when
+    known, 'merge', 'cherry-pick', 'revert' or 'bisect', detected like git's
+    own git-prompt.sh does.
+    """
+    gitdir = repo.gitdir
+    operation = ''
+    progress = None
+    rebase_merge = os.path.join(gitdir, 'rebase-merge')
+    rebase_apply = os.path.join(gitdir, 'rebase-apply')
+    if os.path.isdir(rebase_merge):
+        operation = 'rebase'
+        progress = read_file(os.path.join(rebase_merge, 'msgnum')), read_file(os.path.join(rebase_merge, 'end'))
+    elif os.path.isdir(rebase_apply):
+        if os.path.exists(os.path.join(rebase_apply, 'rebasing')):
+            operation = 'rebase'
+        elif os.path.exists(os.path.join(rebase_apply, 'applying')):
+            operation = 'am'
+        else:
+            operation = 'am/rebase'
+        progress = read_file(os.path.join(rebase_apply, 'next')), read_file(os.path.join(rebase_apply, 'last'))
+    elif os.path.exists(os.path.join(gitdir, 'MERGE_HEAD')):
+        operation = 'merge'
+    elif os.path.exists(os.path.join(gitdir, 'CHERRY_PICK_HEAD')):
+        operation = 'cherry-pick'
+    elif os.path.exists(os.path.join(gitdir, 'REVERT_HEAD')):
+        operation = 'revert'
+    else:
+        # a stopped multi-commit cherry-pick or revert only leaves its todo list
+        todo = read_file(os.path.join(gitdir, 'sequencer', 'todo'))
+        if todo is not None:
+            if todo.startswith((b'p ', b'pick ')):
+                operation = 'cherry-pick'
+            elif todo.startswith(b'revert '):
+                operation = 'revert'
+    if os.path.exists(os.path.join(gitdir, 'BISECT_LOG')) and not operation:
+        operation = 'bisect'
+    if progress and all(progress):
+        step, total = (value.decode('ascii', 'replace').strip() for value in progress)
+        operation += ' %s/%s' % (step, total)
+    return operation
+
+
+# (common dir, tag oid) -> peeled oid, objects never change and linked worktrees share them
+_peeled = {}
+
+
+def peel_tag(repo, oid, depth=5):
+    """return the oid an annotated tag object points to, oid itself if it is not a tag,
+    None if the object is packed and cannot be read without git"""
+    key = (repo.commondir, oid)
+    if key not in _peeled:
+        peeled = _peel_tag(repo, oid, depth)
+        if peeled is None:
+            return None
+        _peeled[key] = peeled
+    return _peeled[key]
+
+
+def _peel_tag(repo, oid, depth):
+    for _ in range(depth):
+        content = read_file(os.path.join(repo.commondir, 'objects', oid[:2], oid[2:]))
+        if content is None:
+            return None
+        try:
+            data = zlib.decompress(content)
+        except zlib.error:
+            return None
+        header, _, body = data.partition(b'\0')
+        if not header.startswith(b'tag '):
+            return oid
+        oid = body[len(b'object '):body.index(b'\n')].decode('ascii')
+    return None
+
+
+def version_key(name):
+    """sort key ordering tag names like git's version:refname"""
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.split(r'(\d+)', name)]
+
+
+def tags_pointing_at(repo, oid, packed=None):
+    """return the tag names pointing at oid, highest version first, None if some tag cannot be peeled"""
+    if packed is None:
+        packed = packed_refs(repo)
+    tags = {}
+    for ref, (tag_oid, peeled) in packed.items():
+        if ref.startswith('refs/tags/'):
+            if peeled is None:
+                peeled = peel_tag(repo, tag_oid)
+                if peeled is None:
+                    return None
+            tags[ref[len('refs/tags/'):]] = oid in (tag_oid, peeled)
+    # loose refs take precedence over packed ones
+    top = os.path.join(repo.commondir, 'refs', 'tags')
+    for root, dirs, files in os.walk(top):
+        for name in files:
+            content = read_file(os.path.join(root, name))
+            if content is None:
+                continue
+            tag = os.path.relpath(os.path.join(root, name), top).replace(os.sep, '/')
+            tag_oid = content.decode('ascii', 'replace').strip()
+            if tag_oid != oid:
+                packed_oid, peeled = packed.get('refs/tags/' + tag, (None, None))
+                if packed_oid != tag_oid or peeled is None:
+                    peeled = peel_tag(repo, tag_oid)
+                    if peeled is None:
+                        return None
+                tags[tag] = peeled == oid
+            else:
+                tags[tag] = True
+    return sorted((tag for tag, match in tags.items() if match), key=version_key, reverse=True)
@@ -1,103 +1,809 @@
 #!/usr/bin/env python3
 from __future__ import print_function
 
+import argparse
+import hashlib
+import json
 import os
+import socket
 import sys
-import re
-from subprocess import Popen, PIPE, check_output
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import Popen, PIPE, SubprocessError, TimeoutExpired, check_output
 
+from socketserver import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+
+import gitrefs
+import gittimings
+
+
+# Seconds without any request after which the daemon exits on its own
+DAEMON_IDLE_TIMEOUT = 3600
+
+# Where state that outlives a run goes when no --cache-dir is given
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'gitstatus')
+
+# Ahead/behind counts remembered per repository
+AHEAD_BEHIND_ENTRIES = 64
+
+# Seconds an adaptive repository keeps skipping untracked files before a full status is tried again
+ADAPTIVE_PROBE_INTERVAL = 300
+
+# Seconds a cached status is trusted at most. Writing to a file does not move
+# the mtime of its directory, so the work tree fingerprint never sees an edit to
+# a tracked file: every edit shows up this late
+CACHE_TTL = 2
+
+# Seconds a clean submodule is trusted to stay clean while its HEAD, index and
+# top-level directories are unchanged
+SUBMODULE_CACHE_TTL = 60
 
-def get_tagname_or_hash():
-    """return tagname if exists else hash"""
-    # get hash
-    hash_cmd = ['git', 'rev-parse', '--short', 'HEAD']
-    hash_ = check_output(hash_cmd).decode('utf-8').strip()
 
-    # get tagname
-    tags_cmd = ['git', 'for-each-ref', '--points-at=HEAD', '--count=2', '--sort=-version:refname', '--format=%(refname:short)', 'refs/tags']
-    tags = check_output(tags_cmd).decode('utf-8').split()
+Status = namedtuple('Status', [
+    'branch', 'ahead', 'behind', 'staged', 'conflicts', 'changed', 'untracked', 'stashed', 'clean', 'deleted',
+    'upstream', 'oid', 'untracked_skipped', 'operation', 'tag',
+], defaults=[0, '', ''])
 
+# Fields printed for the prompt, in the order the plugin reads them
+PROMPT_FIELDS = Status._fields[:10] + ('untracked_skipped',)
+
+# Fields added by the NUL-separated payload, the last one being the short oid
+PAYLOAD_FIELDS = ('upstream', 'operation', 'tag')
+
+# branch, oid, upstream, ahead, behind, stashes and every entry in one process
+STATUS_ARGS = ['--porcelain=v2', '--branch', '--show-stash', '-z']
+
+# Entry counters summed over a repository and its submodules
+ENTRY_FIELDS = ('staged', 'conflicts', 'changed', 'untracked', 'deleted')
+
+Repository = namedtuple('Repository', ['worktree', 'gitdir', 'commondir'])
+
+
+def get_tags(oid, cwd=None, repo=None):
+    """return the tags pointing at oid, highest version first (only the first two when git is asked)"""
+    if not oid:
+        return []
+    # from the tag refs when every tag can be peeled without git
+    if repo is None:
+        repo = find_repository(cwd or os.getcwd())
+    tags = gitrefs.tags_pointing_at(repo, oid) if repo is not None else None
+    if tags is None:
+        tags_cmd = ['git', 'for-each-ref', '--points-at=%s' % oid, '--count=2', '--sort=-version:refname', '--format=%(refname:short)', 'refs/tags']
+        started = time.time()
+        tags = check_output(tags_cmd, cwd=cwd).decode('utf-8').split()
+        gittimings.record('git for-each-ref', started)
+    return tags
+
+
+def get_tagname_or_hash(oid, tags):
+    """return tagname if exists else hash"""
     if tags:
         return tags[0] + ('+' if len(tags) > 1 else '')
-    elif hash_:
-        return hash_
+    elif oid:
+        return oid[:7]
     return None
 
-# Re-use method from https://github.com/magicmonty/bash-git-prompt to get stashs count
-def get_stash():
-    cmd = Popen(['git', 'rev-parse', '--git-dir'], stdout=PIPE, stderr=PIPE)
-    so, se = cmd.communicate()
-    stash_file = '%s%s' % (so.decode('utf-8').rstrip(), '/logs/refs/stash')
 
+def parse_status(stdout, cwd=None, repo=None):
+    """parse the output of `git status --porcelain=v2 --branch --show-stash -z` in a single pass
+
+    Records are compared as bytes, no entry is decoded or matched against a regex.
+    Git before 2.35 does not report stashes, they are then counted in the stash
+    reflog of repo, or of the repository containing cwd.
+    """
+    branch = upstream = oid = ''
+    ahead = behind = 0
+    stashed = None
+    staged = conflicts = changed = deleted = untracked = 0
+    renamed = False
+    for record in stdout.split(b'\0'):
+        if renamed:
+            # the original path of a rename or copy is a record of its own
+            renamed = False
+            continue
+        kind = record[:1]
+        if kind == b'1' or kind == b'2':
+            # <kind> <XY> ..., X is the index status and Y the work tree one, '.' when unmodified
+            y = record[3:4]
+            if y == b'M':
+                changed += 1
+            elif y == b'D':
+                deleted += 1
+            if record[2:3] != b'.':
+                staged += 1
+            renamed = kind == b'2'
+        elif kind == b'?':
+            untracked += 1
+        elif kind == b'u':
+            conflicts += 1
+        elif kind == b'#':
+            key, _, value = record[2:].partition(b' ')
+            if key == b'branch.oid':
+                oid = value.decode('utf-8')
+            elif key == b'branch.head':
+                branch = value.decode('utf-8')
+            elif key == b'branch.upstream':
+                upstream = value.decode('utf-8')
+            elif key == b'branch.ab':
+                ahead_, behind_ = value.split(b' ')
+                ahead, behind = int(ahead_[1:]), int(behind_[1:])
+            elif key == b'stash':
+                stashed = int(value)
+
+    if oid == '(initial)':
+        oid = ''
+    if stashed is None:
+        if repo is None:
+            repo = find_repository(cwd or os.getcwd())
+        stashed = gitrefs.stash_count(repo) if repo is not None else 0
+    clean = int(not (staged or conflicts or changed or deleted or untracked))
+    return Status(branch, ahead, behind, staged, conflicts, changed, untracked, stashed, clean, deleted, upstream, oid)
+
+
+def read_gitfile(path):
+    """return the directory a `gitdir: <path>` file points to, None if path is not such a file"""
     try:
-        with open(stash_file) as f:
-            return sum(1 for _ in f)
-    except IOError:
-        return 0
+        with open(path) as f:
+            content = f.read()
+    except (IOError, OSError):
+        return None
+    if not content.startswith('gitdir: '):
+        return None
+    return os.path.normpath(os.path.join(os.path.dirname(path), content[len('gitdir: '):].strip()))
+
+
+def make_repository(worktree, gitdir):
+    # linked worktrees share refs and objects with the main repository
+    commondir = gitdir
+    try:
+        with open(os.path.join(gitdir, 'commondir')) as f:
+            commondir = os.path.normpath(os.path.join(gitdir, f.read().strip()))
+    except (IOError, OSError):
+        pass
+    return Repository(worktree, gitdir, commondir)
+
+
+def find_repository(path):
+    """return the Repository containing path by looking for `.git` in its parents, without forking git"""
+    if 'GIT_DIR' in os.environ or 'GIT_WORK_TREE' in os.environ:
+        return None
+    path = os.path.abspath(path)
+    while True:
+        dotgit = os.path.join(path, '.git')
+        gitdir = dotgit if os.path.isdir(dotgit) else read_gitfile(dotgit)
+        if gitdir:
+            return make_repository(path, gitdir)
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def find_repositories(top, nested=False, max_depth=None):
+    """yield the Repository of every work tree below top, found in a single os.scandir walk
+
+    Symbolic links are not followed. The walk does not descend into work trees
+    unless nested is set, so that submodules and vendored checkouts inside them
+    are reported on their own.
+    """
+    stack = [(os.path.abspath(top), 0)]
+    while stack:
+        path, depth = stack.pop()
+        gitdir = None
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.name == '.git':
+                        gitdir = entry.path if entry.is_dir(follow_symlinks=False) else read_gitfile(entry.path)
+                    elif entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+        except OSError:
+            continue
+        if gitdir:
+            yield make_repository(path, gitdir)
+            if not nested:
+                continue
+        if max_depth is None or depth < max_depth:
+            stack.extend((subdir, depth + 1) for subdir in sorted(subdirs, reverse=True))
+
+
+def list_submodules(repo):
+    """return the Repository of every checked out submodule of repo, as listed in its .gitmodules"""
+    submodules = []
+    config = gitrefs.read_config(os.path.join(repo.worktree, '.gitmodules'))
+    for (section, name), values in sorted(config.items()):
+        if section != 'submodule' or not values.get('path'):
+            continue
+        worktree = os.path.normpath(os.path.join(repo.worktree, values['path']))
+        dotgit = os.path.join(worktree, '.git')
+        gitdir = dotgit if os.path.isdir(dotgit) else read_gitfile(dotgit)
+        if gitdir:
+            submodules.append(make_repository(worktree, gitdir))
+    return submodules
+
+
+def stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_ino, st.st_size, st.st_mtime]
+
+
+def repository_signature(repo, status):
+    """stat information of every file the status of repo depends on"""
+    paths = [
+        os.path.join(repo.gitdir, 'index'),
+        os.path.join(repo.gitdir, 'HEAD'),
+        os.path.join(repo.commondir, 'packed-refs'),
+        os.path.join(repo.commondir, 'logs', 'refs', 'stash'),
+    ]
+    if status.branch:
+        paths.append(os.path.join(repo.commondir, 'refs', 'heads', status.branch))
+    if status.upstream:
+        paths.append(os.path.join(repo.commondir, 'refs', 'remotes', status.upstream))
+    signature = [stat_key(path) for path in paths]
+
+    # cheap work tree fingerprint: the root and its direct subdirectories, which
+    # only catches files created, removed or renamed there, never content edits
+    signature.append(stat_key(repo.worktree))
+    try:
+        for entry in os.scandir(repo.worktree):
+            if entry.name != '.git' and entry.is_dir(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                signature.append([entry.name, st.st_ino, st.st_mtime])
+    except OSError:
+        pass
+    return signature
+
+
+def write_json(path, data):
+    """replace the file at path with data as JSON at once; caches are optional, errors are ignored"""
+    try:
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.rename(path + '.tmp', path)
+    except (IOError, OSError):
+        pass
+
+
+class StatusCache(object):
+    """last Status computed per repository, reused while the files it was computed from are unchanged
+
+    Entries live in memory and, when a directory is given, in one JSON file per
+    repository so that separate gitstatus.py runs share them. Statuses counting
+    the entries of submodules are kept apart from the plain ones.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, directory=None):
+        self.ttl = ttl
+        self.directory = directory
+        self.entries = {}
+
+    def _key(self, repo, submodules=False):
+        return repo.gitdir + '\0submodules' if submodules else repo.gitdir
+
+    def _path(self, repo, submodules=False):
+        key = hashlib.sha1(self._key(repo, submodules).encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.directory, key + '.json')
+
+    def _load(self, repo, submodules=False):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(repo, submodules)) as f:
+                created, signature, status = json.load(f)
+            return created, signature, Status(*status)
+        except (IOError, OSError, ValueError, TypeError):
+            return None
+
+    def get(self, repo, submodules=False):
+        """the cached status of repo, with submodules the one counting the entries of its submodules"""
+        entry = self.entries.get(self._key(repo, submodules)) or self._load(repo, submodules)
+        if entry is None:
+            return None
+        created, signature, status = entry
+        if time.time() - created > self.ttl or signature != repository_signature(repo, status):
+            return None
+        return status
+
+    def put(self, repo, status, started, submodules=False):
+        signature = repository_signature(repo, status)
+        # like git's racy index check: a file modified in the same second as
+        # the run may change again without its mtime moving, do not trust it
+        if any(key and key[-1] >= started - 1 for key in signature):
+            return
+        entry = (started, signature, status)
+        self.entries[self._key(repo, submodules)] = entry
+        if self.directory:
+            write_json(self._path(repo, submodules), entry)
+
 
+class SubmoduleCache(StatusCache):
+    """submodules found clean, keyed on their git dir and the commit checked out
 
-# `git status --porcelain --branch` can collect all information
-# branch, remote_branch, untracked, staged, changed, conflicts, ahead, behind
-po = Popen(['git', 'status', '--porcelain', '--branch'], env=dict(os.environ, LANG="C"), stdout=PIPE, stderr=PIPE)
-stdout, sterr = po.communicate()
-if po.returncode != 0:
-    sys.exit(0)  # Not a git repository
-
-# collect git status information
-untracked, staged, changed, deleted, conflicts = [], [], [], [], []
-ahead, behind = 0, 0
-status = [(line[0], line[1], line[2:]) for line in stdout.decode('utf-8').splitlines()]
-for st in status:
-    if st[0] == '#' and st[1] == '#':
-        if re.search('Initial commit on', st[2]) or re.search('No commits yet on', st[2]):
-            branch = st[2].split(' ')[-1]
-        elif re.search('no branch', st[2]):  # detached status
-            branch = get_tagname_or_hash()
-        elif len(st[2].strip().split('...')) == 1:
-            branch = st[2].strip()
+    A submodule is skipped while its HEAD still points to the same commit and
+    the files of its status signature are unchanged, for at most ttl seconds.
+    """
+
+    def __init__(self, ttl=SUBMODULE_CACHE_TTL, directory=None):
+        super(SubmoduleCache, self).__init__(ttl, directory)
+
+    def _path(self, repo, submodules=False):
+        return super(SubmoduleCache, self)._path(repo, submodules)[:-len('.json')] + '-submodule.json'
+
+    def clean(self, repo):
+        status = self.get(repo)
+        return status is not None and status.oid == gitrefs.read_head(repo)[1]
+
+    def put(self, repo, status, started):
+        if status.clean:
+            super(SubmoduleCache, self).put(repo, status, started)
         else:
-            # current and remote branch info
-            branch, rest = st[2].strip().split('...')
-            if len(rest.split(' ')) == 1:
-                # remote_branch = rest.split(' ')[0]
-                pass
-            else:
-                # ahead or behind
-                divergence = ' '.join(rest.split(' ')[1:])
-                divergence = divergence.lstrip('[').rstrip(']')
-                for div in divergence.split(', '):
-                    if 'ahead' in div:
-                        ahead = int(div[len('ahead '):].strip())
-                    elif 'behind' in div:
-                        behind = int(div[len('behind '):].strip())
-    elif st[0] == '?' and st[1] == '?':
-        untracked.append(st)
+            self.entries.pop(repo.gitdir, None)
+
+
+class StatusTimeout(Exception):
+    """git status did not finish within the time budget"""
+
+
+class AheadBehindCache(object):
+    """ahead/behind counts keyed on the (HEAD oid, upstream oid) pair, in memory and optionally on disk"""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.entries = {}
+
+    def _path(self, repo):
+        key = hashlib.sha1(repo.commondir.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.directory, key + '-ahead-behind.json')
+
+    def _counts(self, repo):
+        counts = self.entries.get(repo.commondir)
+        if counts is None:
+            counts = {}
+            if self.directory:
+                try:
+                    with open(self._path(repo)) as f:
+                        counts = json.load(f)
+                except (IOError, OSError, ValueError):
+                    pass
+            self.entries[repo.commondir] = counts
+        return counts
+
+    def get(self, repo, head, upstream):
+        counts = self._counts(repo)
+        key = head + '...' + upstream
+        if key not in counts:
+            started = time.time()
+            out = check_output(['git', 'rev-list', '--left-right', '--count', key], cwd=repo.worktree)
+            gittimings.record('git rev-list', started)
+            counts[key] = [int(count) for count in out.split()]
+            while len(counts) > AHEAD_BEHIND_ENTRIES:
+                del counts[next(iter(counts))]
+            self._save(repo, counts)
+        return counts[key]
+
+    def _save(self, repo, counts):
+        if self.directory:
+            write_json(self._path(repo), counts)
+
+
+def compute_branch_status(repo, ahead_behind=None):
+    """return the Status of repo with branch, upstream, ahead/behind and stashes only, read from the git dir
+
+    Entry counters are left at 0. git is only run for ahead/behind counts that
+    are not cached yet, and for tags that cannot be peeled from loose objects.
+    """
+    ref, oid = gitrefs.read_head(repo)
+    upstream = tag = ''
+    ahead = behind = 0
+    if ref is None:
+        tags = get_tags(oid, repo.worktree, repo)
+        branch = get_tagname_or_hash(oid, tags) if oid else ''
+        tag = tags[0] if tags else ''
     else:
-        if st[1] == 'M':
-            changed.append(st)
-        if st[1] == 'D':
-            deleted.append(st)
-        if st[0] == 'U':
-            conflicts.append(st)
-        elif st[0] != ' ':
-            staged.append(st)
-
-stashed = get_stash()
-if not changed and not deleted and not staged and not conflicts and not untracked:
-    clean = 1
-else:
-    clean = 0
-
-out = ' '.join([
-    branch,
-    str(ahead),
-    str(behind),
-    str(len(staged)),
-    str(len(conflicts)),
-    str(len(changed)),
-    str(len(untracked)),
-    str(stashed),
-    str(clean),
-    str(len(deleted))
-])
-print(out, end='')
+        branch = ref[len('refs/heads/'):] if ref.startswith('refs/heads/') else ref
+        name, upstream_ref = gitrefs.upstream_of(repo, branch)
+        if name:
+            upstream = name
+            upstream_oid = gitrefs.resolve_ref(repo, upstream_ref)
+            if oid and upstream_oid:
+                if ahead_behind is None:
+                    ahead_behind = AheadBehindCache()
+                ahead, behind = ahead_behind.get(repo, oid, upstream_oid)
+    return Status(branch, ahead, behind, 0, 0, 0, 0, gitrefs.stash_count(repo), 0, 0, upstream, oid or '', tag=tag)
+
+
+def run_git_status(cwd=None, args=STATUS_ARGS, env=None, timeout=None):
+    """return the raw output of `git status <args>`, None outside of a repository"""
+    started = time.time()
+    po = Popen(['git', 'status'] + list(args), cwd=cwd, env=dict(os.environ, LANG="C", **(env or {})), stdout=PIPE, stderr=PIPE)
+    try:
+        stdout, sterr = po.communicate(timeout=timeout)
+    except TimeoutExpired:
+        po.kill()
+        po.communicate()
+        gittimings.record('git status (timeout)', started)
+        raise StatusTimeout()
+    gittimings.record('git status', started)
+    if po.returncode != 0:
+        return None  # Not a git repository
+    return stdout
+
+
+def resolve_branch(status, cwd=None):
+    """name a detached HEAD after its tag or short hash"""
+    if status.branch == '(detached)':
+        tags = get_tags(status.oid, cwd)
+        status = status._replace(branch=get_tagname_or_hash(status.oid, tags), tag=tags[0] if tags else '')
+    return status
+
+
+def status_args(untracked=True, submodules=None):
+    args = STATUS_ARGS if untracked else STATUS_ARGS + ['--untracked-files=no']
+    if submodules is not None:
+        # new commits still show up, the content of submodules is gathered by add_submodules
+        args = args + ['--ignore-submodules=dirty']
+    return args
+
+
+def add_submodules(status, repo, timeout=None, untracked=True, submodules=None):
+    """add the entries of the checked out submodules of repo to status
+
+    Every submodule that is not known to be clean gets a worker of its own,
+    nested submodules are handled the same way by that worker.
+    """
+    pending = [sub for sub in list_submodules(repo) if not submodules.clean(sub)]
+    if not pending:
+        return status
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+        results = list(pool.map(lambda sub: compute_submodule_status(sub, timeout, untracked, submodules), pending))
+    counts = dict((field, getattr(status, field)) for field in ENTRY_FIELDS)
+    for sub, sub_status in zip(pending, results):
+        if sub_status is None:
+            continue
+        submodules.put(sub, sub_status, started)
+        for field in ENTRY_FIELDS:
+            counts[field] += getattr(sub_status, field)
+    return status._replace(clean=int(not any(counts.values())), **counts)
+
+
+def compute_submodule_status(repo, timeout, untracked, submodules):
+    stdout = run_git_status(repo.worktree, status_args(untracked, submodules), timeout=timeout)
+    if stdout is None:
+        return None
+    return add_submodules(parse_status(stdout, repo=repo), repo, timeout, untracked, submodules)
+
+
+def compute_status(cwd=None, timeout=None, untracked=True, submodules=None):
+    """run git to get the Status of the repository containing cwd, None outside of a repository
+
+    With a SubmoduleCache, the entries of submodules are counted as entries of the repository.
+    """
+    stdout = run_git_status(cwd, status_args(untracked, submodules), timeout=timeout)
+    if stdout is None:
+        return None
+    started = time.time()
+    status = parse_status(stdout, cwd)
+    gittimings.record('parse', started)
+    status = resolve_branch(status, cwd)
+    if submodules is not None:
+        repo = find_repository(cwd or os.getcwd())
+        if repo is not None:
+            status = add_submodules(status, repo, timeout, untracked, submodules)
+    return status if untracked else status._replace(untracked_skipped=1)
+
+
+class AdaptiveUntracked(object):
+    """decide per repository whether git status lists untracked files, from the duration of previous runs
+
+    A repository whose full status takes longer than `threshold` seconds is
+    switched to --untracked-files=no. Every `probe_interval` seconds a full
+    status is tried again, and the repository is switched back once such a run
+    takes less than half the threshold. Switched repositories are remembered in
+    `adaptive.json` under directory. A run given up on after --timeout counts as
+    slower than the threshold. The daemon and --scan share one instance between
+    threads.
+    """
+
+    def __init__(self, threshold, directory=None, probe_interval=ADAPTIVE_PROBE_INTERVAL):
+        self.threshold = threshold
+        self.directory = directory
+        self.probe_interval = probe_interval
+        self.lock = threading.Lock()
+        self.switched = None  # gitdir -> time of the last slow full run
+
+    def _load(self):
+        if self.switched is None:
+            self.switched = {}
+            if self.directory:
+                try:
+                    with open(os.path.join(self.directory, 'adaptive.json')) as f:
+                        self.switched = json.load(f)
+                except (IOError, OSError, ValueError):
+                    pass
+        return self.switched
+
+    def skip_untracked(self, repo):
+        with self.lock:
+            since = self._load().get(repo.gitdir)
+        return since is not None and time.time() - since < self.probe_interval
+
+    def record(self, repo, elapsed, skipped):
+        """account for a run of elapsed seconds, skipped telling whether untracked files were left out"""
+        if skipped:
+            return
+        with self.lock:
+            switched = self._load()
+            if elapsed > self.threshold or (repo.gitdir in switched and elapsed >= self.threshold / 2):
+                switched[repo.gitdir] = time.time()
+            elif repo.gitdir in switched:
+                del switched[repo.gitdir]
+            else:
+                return
+            # under the lock: other threads would change the dict while it is dumped, or write the file too
+            if self.directory:
+                write_json(os.path.join(self.directory, 'adaptive.json'), dict(switched))
+
+
+def get_status(cwd=None, cache=None, watchers=None, timeout=None, branch_only=False, ahead_behind=None,
+               adaptive=None, submodules=None):
+    """return the Status of the repository containing cwd, from cache when nothing changed since"""
+    repo = find_repository(cwd or os.getcwd())
+    status = lookup_status(repo, cwd, cache, watchers, timeout, branch_only, ahead_behind, adaptive, submodules)
+    if status is not None and repo is not None:
+        # not part of the cache signature, a few stat calls are cheaper than tracking it
+        status = status._replace(operation=gitrefs.operation_in_progress(repo))
+    return status
+
+
+def lookup_status(repo, cwd, cache, watchers, timeout, branch_only, ahead_behind, adaptive, submodules):
+    if branch_only:
+        return compute_branch_status(repo, ahead_behind) if repo is not None else None
+    # watchers do not look into submodules
+    if repo is not None and watchers is not None and submodules is None:
+        watcher = watchers.get(repo)
+        if watcher is not None:
+            return watcher.status()
+    if repo is not None and cache is not None:
+        status = cache.get(repo, submodules is not None)
+        if status is not None:
+            return status
+
+    untracked = repo is None or adaptive is None or not adaptive.skip_untracked(repo)
+    started = time.time()
+    try:
+        status = compute_status(cwd, timeout, untracked, submodules)
+    except StatusTimeout:
+        if repo is not None and adaptive is not None:
+            # killed around the timeout, which may be below the threshold: the run was too slow either way
+            adaptive.record(repo, float('inf'), not untracked)
+        raise
+    if repo is not None and adaptive is not None:
+        adaptive.record(repo, time.time() - started, not untracked)
+    if repo is not None and cache is not None and status is not None:
+        cache.put(repo, status, started, submodules is not None)
+    return status
+
+
+def timed_status(cwd=None, launched=None, **options):
+    """get_status() with the duration of its phases logged when timings are enabled
+
+    launched is the time the interpreter was started at, as measured by the caller.
+    """
+    started = time.time()
+    gittimings.begin(cwd or os.getcwd())
+    if launched:
+        gittimings.record('interpreter', launched)
+    try:
+        return get_status(cwd, **options)
+    finally:
+        gittimings.record('total', started)
+        gittimings.end()
+
+
+def format_status(status, nul=False):
+    """return the prompt fields of status separated by spaces, or with nul, the whole payload separated by NULs"""
+    if status is None:
+        return ''
+    fields = [str(getattr(status, field)) for field in PROMPT_FIELDS]
+    if not nul:
+        return ' '.join(fields)
+    # upstream, operation and tag may be empty or, for the operation, contain spaces
+    fields += [getattr(status, field) for field in PAYLOAD_FIELDS]
+    fields.append(status.oid[:7])
+    return '\0'.join(fields)
+
+
+def scan(top, out, jobs, nested=False, max_depth=None, nul=False, **options):
+    """write `<path><TAB><status>` for every repository below top, in the order their status completes
+
+    Statuses are computed by a pool of jobs threads while the walk goes on, each
+    thread waiting on its own git process and writing its line as soon as it is
+    done. Repositories whose status could not be computed, because git timed out
+    or failed, are listed with an empty status.
+    """
+    top = os.path.abspath(top)
+    lock = threading.Lock()
+
+    def write(future, repo):
+        try:
+            line = format_status(future.result(), nul)
+        except (StatusTimeout, OSError, SubprocessError):
+            line = ''
+        with lock:
+            out.write(os.path.relpath(repo.worktree, top) + '\t' + line + '\n')
+            out.flush()
+
+    count = 0
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for repo in find_repositories(top, nested, max_depth):
+            future = pool.submit(timed_status, repo.worktree, **options)
+            future.add_done_callback(lambda future, repo=repo: write(future, repo))
+            count += 1
+    return count
+
+
+class StatusRequestHandler(StreamRequestHandler):
+    """answer one directory per connection with its formatted status line"""
+
+    def handle(self):
+        # [<option> ...<TAB>]<directory>, options being branch-only, submodules, stat-cache and nul
+        request = self.rfile.readline().decode('utf-8', 'surrogateescape').rstrip('\n')
+        options, _, path = request.rpartition('\t')
+        options = options.split()
+        try:
+            status = timed_status(path or None, cache=self.server.cache if 'stat-cache' in options else None,
+                                  watchers=self.server.watchers,
+                                  branch_only='branch-only' in options, ahead_behind=self.server.ahead_behind,
+                                  adaptive=self.server.adaptive,
+                                  submodules=self.server.submodules if 'submodules' in options else None)
+            out = format_status(status, 'nul' in options)
+        except Exception:
+            out = ''
+        self.wfile.write(out.encode('utf-8', 'surrogateescape') + b'\n')
+
+
+class StatusServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+    idle = False
+    cache = None
+    watchers = None
+    ahead_behind = None
+    adaptive = None
+    submodules = None
+
+    def handle_timeout(self):
+        self.idle = True
+
+
+def daemon_running(sock_path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(sock_path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        client.close()
+
+
+def serve(sock_path, idle_timeout=DAEMON_IDLE_TIMEOUT, cache=None, watchers=None, adaptive=None):
+    """answer status requests on a Unix socket until idle for idle_timeout seconds"""
+    if os.path.exists(sock_path):
+        if os.lstat(sock_path).st_uid != os.getuid():
+            return 1  # not ours, clients will not use it either
+        if daemon_running(sock_path):
+            return 0
+        os.unlink(sock_path)  # left over by a daemon that died
+
+    old_umask = os.umask(0o077)
+    try:
+        server = StatusServer(sock_path, StatusRequestHandler)
+    except socket.error:
+        return 0  # another shell started a daemon at the same time
+    finally:
+        os.umask(old_umask)
+
+    server.timeout = idle_timeout or None
+    server.cache = cache
+    server.watchers = watchers
+    server.ahead_behind = AheadBehindCache()
+    server.adaptive = adaptive
+    server.submodules = SubmoduleCache()
+    try:
+        while not server.idle:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.unlink(sock_path)
+        except OSError:
+            pass
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print the git status fields used by the git-prompt plugin.")
+    parser.add_argument('--daemon', metavar='SOCKET', help="serve status requests on the given Unix socket")
+    parser.add_argument('--idle-timeout', type=int, default=DAEMON_IDLE_TIMEOUT, metavar='SECONDS',
+                        help="exit the daemon after this many seconds without requests (0: never)")
+    parser.add_argument('--cache-dir', metavar='DIR', help="keep the last status of each repository in DIR")
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL, metavar='SECONDS',
+                        help="reuse a cached status for at most this many seconds, edits to tracked files "
+                             "show up this late (0: no cache)")
+    parser.add_argument('--timeout', type=float, metavar='SECONDS',
+                        help="give up, printing nothing, when git status takes longer than this")
+    parser.add_argument('--watch', action='store_true',
+                        help="with --daemon, track work trees with inotify instead of rescanning them for every request")
+    parser.add_argument('--branch-only', action='store_true',
+                        help="only report branch, upstream, ahead/behind and stashes, read without running git status")
+    parser.add_argument('--adaptive', type=float, metavar='SECONDS',
+                        help="stop listing untracked files in repositories whose status takes longer than this")
+    parser.add_argument('-z', '--nul', action='store_true',
+                        help="separate fields with NULs and add the upstream, operation in progress, tag and short oid")
+    parser.add_argument('--scan', metavar='DIR', help="print the status of every repository below DIR, one per line")
+    parser.add_argument('--jobs', type=int, default=(os.cpu_count() or 1) * 2, metavar='N',
+                        help="with --scan, compute this many statuses at the same time")
+    parser.add_argument('--nested', action='store_true', help="with --scan, also look for repositories inside work trees")
+    parser.add_argument('--max-depth', type=int, metavar='N', help="with --scan, do not look deeper than N directories")
+    parser.add_argument('--submodules', action='store_true',
+                        help="count the entries of checked out submodules, computed concurrently, as entries of the repository")
+    args = parser.parse_args(argv)
+
+    # $GITSTATUS_TIMINGS turns per-phase timings on, $GITSTATUS_T0 is when the shell started us
+    gittimings.enable()
+    try:
+        launched = float(os.environ.get('GITSTATUS_T0', ''))
+    except ValueError:
+        launched = None
+
+    # the daemon keeps its cache in memory for the requests asking for it, single runs share one on disk
+    cache = None
+    if args.cache_ttl > 0 and (args.daemon or args.cache_dir):
+        cache = StatusCache(args.cache_ttl, args.cache_dir)
+
+    adaptive = None
+    if args.adaptive:
+        adaptive = AdaptiveUntracked(args.adaptive, args.cache_dir or DEFAULT_CACHE_DIR)
+
+    submodules = SubmoduleCache(directory=args.cache_dir) if args.submodules else None
+
+    if args.daemon:
+        watchers = None
+        if args.watch:
+            try:
+                from gitwatch import WatcherPool
+                watchers = WatcherPool()
+            except (ImportError, OSError):
+                pass  # no inotify on this system, rescan as usual
+        return serve(args.daemon, args.idle_timeout, cache, watchers, adaptive)
+
+    if args.scan:
+        scan(args.scan, sys.stdout, args.jobs, args.nested, args.max_depth, args.nul, cache=cache,
+             timeout=args.timeout, branch_only=args.branch_only, ahead_behind=AheadBehindCache(args.cache_dir),
+             adaptive=adaptive, submodules=submodules)
+        return 0
+
+    try:
+        status = timed_status(launched=launched, cache=cache, timeout=args.timeout, branch_only=args.branch_only,
+                              ahead_behind=AheadBehindCache(args.cache_dir), adaptive=adaptive,
+                              submodules=submodules)
+    except StatusTimeout:
+        return 1
+    print(format_status(status, args.nul), end='')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Per-phase timings of the prompt backend, enabled by $GITSTATUS_TIMINGS.
+
+$GITSTATUS_TIMINGS is the path of the log, or 1 for `timings.tsv` in the
+gitstatus cache directory. gitstatus.py and the zsh plugin append one
+`<epoch seconds><TAB><directory><TAB><phase><TAB><milliseconds>` line per
+phase; the log is rotated to `<log>.1` once it grows over TIMINGS_LOG_SIZE.
+
+Run this module to print per-repository latency histograms:
+
+    python3 gittimings.py [LOG]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# Bytes after which the log is rotated
+TIMINGS_LOG_SIZE = 1 << 20
+
+# Upper bounds, in milliseconds, of the histogram buckets
+HISTOGRAM_BUCKETS = [5, 10, 20, 50, 100, 200, 500, 1000, float('inf')]
+
+# Phases measuring a whole prompt update, the first one found is shown as a histogram
+END_TO_END_PHASES = ['zsh fetch', 'total']
+
+_timings = None
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def default_log():
+    cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'gitstatus')
+    return os.path.join(cache_dir, 'timings.tsv')
+
+
+def enable(value=None):
+    """turn recording on when value (by default $GITSTATUS_TIMINGS) is set"""
+    global _timings
+    if value is None:
+        value = os.environ.get('GITSTATUS_TIMINGS')
+    if value:
+        _timings = default_log() if value == '1' else value
+
+
+def begin(directory):
+    """start collecting the phases of one status request in the current thread"""
+    if _timings is not None:
+        _local.directory = directory
+        _local.records = []
+
+
+def record(phase, started):
+    """account for a phase that began at time.time() `started`"""
+    if _timings is None:
+        return
+    records = getattr(_local, 'records', None)
+    if records is not None:
+        records.append((phase, time.time() - started))
+
+
+def end():
+    """append the phases collected since begin() to the log"""
+    records = getattr(_local, 'records', None)
+    if _timings is None or not records:
+        return
+    _local.records = None
+    now = int(time.time())
+    lines = ''.join('%d\t%s\t%s\t%.3f\n' % (now, _local.directory, phase, seconds * 1000)
+                    for phase, seconds in records)
+    with _lock:
+        try:
+            directory = os.path.dirname(_timings)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            if os.path.exists(_timings) and os.path.getsize(_timings) > TIMINGS_LOG_SIZE:
+                os.rename(_timings, _timings + '.1')
+            with open(_timings, 'a') as f:
+                f.write(lines)
+        except (IOError, OSError):
+            pass
+
+
+def read_log(path):
+    """return {directory: {phase: [milliseconds]}} from the log and its rotated predecessor"""
+    samples = defaultdict(lambda: defaultdict(list))
+    for name in (path + '.1', path):
+        try:
+            with open(name) as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) != 4:
+                        continue
+                    try:
+                        samples[fields[1]][fields[2]].append(float(fields[3]))
+                    except ValueError:
+                        continue
+        except (IOError, OSError):
+            pass
+    return samples
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round((len(values) - 1) * fraction)))]
+
+
+def histogram(values, width=40):
+    counts = [0] * len(HISTOGRAM_BUCKETS)
+    for value in values:
+        for index, bound in enumerate(HISTOGRAM_BUCKETS):
+            if value < bound:
+                counts[index] += 1
+                break
+    lines = []
+    low = 0
+    top = max(counts)
+    for bound, count in zip(HISTOGRAM_BUCKETS, counts):
+        label = '>= %g ms' % low if bound == float('inf') else '< %g ms' % bound
+        lines.append('    %-10s %5d %s' % (label, count, '#' * (count * width // top if top else 0)))
+        low = bound
+    return lines
+
+
+def report(path, out=sys.stdout):
+    samples = read_log(path)
+    if not samples:
+        print('no timings in %s' % path, file=out)
+        return 1
+    for directory in sorted(samples):
+        phases = samples[directory]
+        print(directory, file=out)
+        for phase in sorted(phases):
+            values = phases[phase]
+            print('  %-20s n=%-5d p50=%8.2f p95=%8.2f max=%8.2f ms' % (
+                phase, len(values), percentile(values, 0.5), percentile(values, 0.95), max(values)), file=out)
+        for phase in END_TO_END_PHASES:
+            if phase in phases:
+                print('  %s:' % phase, file=out)
+                for line in histogram(phases[phase]):
+                    print(line, file=out)
+                break
+    return 0
+
+
+if __name__ == '__main__':
+    log = sys.argv[1] if len(sys.argv) > 1 else os.environ.get('GITSTATUS_TIMINGS')
+    sys.exit(report(default_log() if not log or log == '1' else log))
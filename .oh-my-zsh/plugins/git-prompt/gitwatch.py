@@ -0,0 +1,366 @@
+"""inotify based work tree tracker for the gitstatus daemon (Linux only).
+
+A RepositoryWatcher keeps one inotify watch per directory of a work tree and
+remembers the status entry of every dirty path. Between two requests only the
+paths reported by inotify are handed to a pathspec-limited `git status`, in the
+spirit of git's fsmonitor protocol. Changes under the git directory (index,
+HEAD, refs, stash) and event queue overflows fall back to a full rescan. A
+changed .gitignore or $GIT_DIR/info/exclude also lists the ignored directories
+and sets the watches up again, since the untracked count of the whole tree may
+change with them.
+"""
+
+from __future__ import print_function
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from subprocess import Popen, PIPE
+
+import gitstatus
+import gittimings
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o0004000
+
+WORKTREE_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+GITDIR_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# Repositories watched at the same time by one daemon
+MAX_WATCHED_REPOSITORIES = 8
+
+# Above this many changed paths a full rescan is cheaper than a long pathspec
+MAX_PATHSPECS = 1000
+
+INCREMENTAL_ARGS = ['--porcelain=v2', '-z']
+
+_libc = None
+
+
+def libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    return _libc
+
+
+class Inotify(object):
+    """non-blocking inotify instance"""
+
+    def __init__(self):
+        self.fd = libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask):
+        wd = libc().inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read(self):
+        """return every queued (wd, mask, name) event without blocking"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return events
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((wd, mask, name))
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def parse_entries(stdout):
+    """map every path of `git status --porcelain=v2 -z` output to its `<kind> <XY>` code"""
+    entries = {}
+    renamed = False
+    for record in stdout.split(b'\0'):
+        if renamed:
+            renamed = False
+            continue
+        kind = record[:1]
+        if kind == b'1':
+            path = record.split(b' ', 8)[8]
+        elif kind == b'2':
+            path = record.split(b' ', 9)[9]
+            renamed = True
+        elif kind == b'u':
+            path = record.split(b' ', 10)[10]
+        elif kind == b'?':
+            path = record[2:]
+        else:
+            continue
+        entries[os.fsdecode(path)] = record[:4]
+    return entries
+
+
+def count_entries(codes):
+    """return the entry counters of a Status, following the rules of gitstatus.parse_status"""
+    staged = conflicts = changed = deleted = untracked = 0
+    for code in codes:
+        kind = code[:1]
+        if kind == b'?':
+            untracked += 1
+        elif kind == b'u':
+            conflicts += 1
+        else:
+            y = code[3:4]
+            if y == b'M':
+                changed += 1
+            elif y == b'D':
+                deleted += 1
+            if code[2:3] != b'.':
+                staged += 1
+    return dict(staged=staged, conflicts=conflicts, changed=changed, deleted=deleted, untracked=untracked,
+                clean=int(not (staged or conflicts or changed or deleted or untracked)))
+
+
+def covered(path, specs):
+    """tell whether path is one of specs or lies below one of them"""
+    path = path.rstrip('/')
+    while True:
+        if path in specs:
+            return True
+        sep = path.rfind('/')
+        if sep < 0:
+            return False
+        path = path[:sep]
+
+
+class RepositoryWatcher(object):
+    """Status of one repository kept up to date from inotify events"""
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.lock = threading.Lock()
+        self.inotify = Inotify()
+        self.dirs = {}  # watch descriptor -> directory relative to the work tree
+        self.git_wds = set()
+        self.ignored = set()
+        self.entries = {}
+        self.pending = set()
+        self.current = None
+        self.rescan = True
+        self.overflow = True
+        self.ignore_changed = False
+        self.failed = False
+
+    def close(self):
+        self.inotify.close()
+
+    def _watch_git_dirs(self):
+        # info/exclude holds ignore rules of the repository
+        paths = [self.repo.gitdir, self.repo.commondir, os.path.join(self.repo.commondir, 'info')]
+        for top in ('refs', os.path.join('logs', 'refs')):
+            for root, subdirs, files in os.walk(os.path.join(self.repo.commondir, top)):
+                paths.append(root)
+        for path in paths:
+            try:
+                self.git_wds.add(self.inotify.add_watch(path, GITDIR_MASK))
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise
+
+    def _watch_tree(self, top):
+        """watch top and the directories below it, except git directories, nested repositories and ignored ones"""
+        stack = [top]
+        while stack:
+            rel = stack.pop()
+            path = os.path.join(self.repo.worktree, rel) if rel else self.repo.worktree
+            try:
+                self.dirs[self.inotify.add_watch(path, WORKTREE_MASK)] = rel
+                it = os.scandir(path)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise
+                continue  # removed in the meantime
+            with it:
+                for entry in it:
+                    if entry.name == '.git' or not entry.is_dir(follow_symlinks=False):
+                        continue
+                    child = rel + '/' + entry.name if rel else entry.name
+                    if child in self.ignored or os.path.lexists(os.path.join(entry.path, '.git')):
+                        continue
+                    stack.append(child)
+
+    def _rewatch(self):
+        self.inotify.close()
+        self.inotify = Inotify()
+        self.dirs.clear()
+        self.git_wds.clear()
+        started = time.time()
+        po = Popen(['git', 'ls-files', '-z', '--others', '--ignored', '--exclude-standard', '--directory'],
+                   cwd=self.repo.worktree, stdout=PIPE, stderr=PIPE)
+        stdout, stderr = po.communicate()
+        gittimings.record('git ls-files', started)
+        self.ignored = set(os.fsdecode(path).rstrip('/') for path in stdout.split(b'\0') if path)
+        self._watch_git_dirs()
+        self._watch_tree('')
+        self.overflow = False
+        self.ignore_changed = False
+
+    def _drain(self, own_run=False):
+        """turn queued events into pending paths, or into a rescan for git directory and ignore rules changes
+
+        Right after one of our own git runs, writes to the index are git
+        refreshing its stat data and are ignored.
+        """
+        for wd, mask, name in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                self.overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                self.git_wds.discard(wd)
+                continue
+            if wd in self.git_wds:
+                if name.endswith('.lock') or (own_run and name == 'index'):
+                    continue
+                if name == 'exclude':
+                    self.ignore_changed = True
+                self.rescan = True
+                continue
+            rel = self.dirs.get(wd)
+            if rel is None or not name:
+                continue
+            path = rel + '/' + name if rel else name
+            if path == '.git':
+                continue
+            if name == '.gitignore':
+                # any path of the directory may now be ignored or not
+                self.ignore_changed = True
+                self.rescan = True
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(path)
+            self.pending.add(path)
+
+    def _full_rescan(self):
+        if self.overflow or self.ignore_changed:
+            self._rewatch()
+        self.inotify.read()
+        self.pending.clear()
+        self.rescan = False
+        stdout = gitstatus.run_git_status(self.repo.worktree)
+        if stdout is None:
+            self.current = None
+            self.entries = {}
+            return
+        self.current = gitstatus.resolve_branch(gitstatus.parse_status(stdout, repo=self.repo), self.repo.worktree)
+        self.entries = parse_entries(stdout)
+        self._drain(own_run=True)
+
+    def _pathspecs(self):
+        specs = set()
+        for path in self.pending:
+            # changes inside an untracked directory are reported as the directory itself
+            parent = path
+            while '/' in parent:
+                parent = parent[:parent.rfind('/')]
+                if self.entries.get(parent + '/', b'')[:1] == b'?':
+                    path = parent
+            specs.add(path)
+        # a created directory and the files created in it are one pathspec
+        return set(spec for spec in specs if '/' not in spec or not covered(spec.rpartition('/')[0], specs))
+
+    def _update(self):
+        specs = self._pathspecs()
+        if len(specs) > MAX_PATHSPECS:
+            return self._full_rescan()
+        self.pending.clear()
+        stdout = gitstatus.run_git_status(self.repo.worktree, INCREMENTAL_ARGS + ['--'] + sorted(specs),
+                                          env={'GIT_LITERAL_PATHSPECS': '1'})
+        if stdout is None:
+            return self._full_rescan()
+        for path in [path for path in self.entries if covered(path, specs)]:
+            del self.entries[path]
+        self.entries.update(parse_entries(stdout))
+        self.current = self.current._replace(**count_entries(self.entries.values()))
+        self._drain(own_run=True)
+
+    def status(self):
+        with self.lock:
+            try:
+                if not self.overflow:
+                    self._drain()
+                if self.overflow or self.rescan or self.current is None:
+                    self._full_rescan()
+                elif self.pending:
+                    self._update()
+            except OSError:
+                # out of inotify watches while following new directories
+                self.failed = True
+                return gitstatus.compute_status(self.repo.worktree)
+            return self.current
+
+
+class WatcherPool(object):
+    """RepositoryWatcher per repository, closing the least recently used ones
+
+    Repositories that cannot be watched (not enough inotify watches) are
+    remembered and left to the regular status path.
+    """
+
+    def __init__(self, size=MAX_WATCHED_REPOSITORIES):
+        libc()
+        self.size = size
+        self.lock = threading.Lock()
+        self.watchers = OrderedDict()
+        self.unwatchable = set()
+
+    def get(self, repo):
+        with self.lock:
+            if repo.gitdir in self.unwatchable:
+                return None
+            watcher = self.watchers.pop(repo.gitdir, None)
+            if watcher is not None and watcher.failed:
+                watcher.close()
+                self.unwatchable.add(repo.gitdir)
+                return None
+            if watcher is None:
+                try:
+                    watcher = RepositoryWatcher(repo)
+                    watcher._rewatch()
+                except OSError:
+                    self.unwatchable.add(repo.gitdir)
+                    if watcher is not None:
+                        watcher.close()
+                    return None
+                while len(self.watchers) >= self.size:
+                    self.watchers.popitem(last=False)[1].close()
+            self.watchers[repo.gitdir] = watcher
+            return watcher
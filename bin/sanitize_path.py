@@ -1,26 +1,239 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+"""Nettoie les variables de chemins : retire les doublons et les répertoires
+inexistants ou non accessibles.
 
+Deux entrées désignant le même répertoire (lien symbolique comme /bin vers
+/usr/bin, barre oblique finale) sont des doublons : seule la première est gardée.
+PYTHONPATH accepte aussi les fichiers existants (archives zip ou egg).
+
+Sans argument, affiche le PATH nettoyé. Avec --export, nettoie PATH, MANPATH,
+FPATH, LD_LIBRARY_PATH, PYTHONPATH et INFOPATH en un seul processus et affiche
+les affectations à évaluer par le shell :
+
+    eval "$(FPATH="$FPATH" python3 ~/bin/sanitize_path.py --export --quiet)"
+
+Avec --shadow-report, liste les commandes du PATH masquées par une commande de
+même nom dans un répertoire précédent.
+
+Avec --hash, affiche les commandes `hash` qui remplissent la table des
+commandes du shell, pour lui éviter de parcourir les répertoires du PATH (lent
+sur un répertoire personnel monté en NFS). La liste des commandes de chaque
+répertoire est gardée avec sa date de modification dans HASH_CACHE : seuls les
+répertoires modifiés depuis sont relus.
+"""
+
+import argparse
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+import shlex
+import stat
 import sys
 
-path=os.getenv('PATH')
-
-items=path.split(':')
-
-final_list = []
-for item in items:
-    add=True
-    if item in final_list:
-        sys.stderr.write('\x1b[0;31;40m' + item + " dupliqué\n" + '\x1b[0m')
-        add=False
-    if not os.path.isdir(item):
-        sys.stderr.write('\x1b[0;31;40m' + item + " n'existe pas\n" + '\x1b[0m')
-        add=False
-    elif not os.access(item, os.R_OK):
-        sys.stderr.write('\x1b[0;31;40m' + item + " non accessible\n" + '\x1b[0m')
-        add=False
-    if add:
+# Variables nettoyées par --export, dans cet ordre
+VARIABLES = ['PATH', 'MANPATH', 'FPATH', 'LD_LIBRARY_PATH', 'PYTHONPATH', 'INFOPATH']
+# Une entrée vide y désigne le chemin par défaut de man et info : elle est gardée
+KEEP_EMPTY = ('MANPATH', 'INFOPATH')
+# FPATH est lié au tableau fpath de zsh et n'a pas à être exporté
+NOT_EXPORTED = ('FPATH',)
+# Une entrée peut y désigner un fichier (archive zip ou egg) plutôt qu'un répertoire
+FILES_ALLOWED = ('PYTHONPATH',)
+
+# Liste des commandes de chaque répertoire du PATH pour --hash
+HASH_CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                          'sanitize_path', 'commands.json')
+
+# Résultat de os.stat (None si absent) par répertoire, partagé entre les variables
+_stat_cache = {}
+_access_cache = {}
+
+
+def error(message, quiet=False):
+    if not quiet:
+        sys.stderr.write('\x1b[0;31;40m' + message + '\n' + '\x1b[0m')
+
+
+def stat_dir(item):
+    if item not in _stat_cache:
+        try:
+            _stat_cache[item] = os.stat(item)
+        except (OSError, ValueError):
+            _stat_cache[item] = None
+    return _stat_cache[item]
+
+
+def is_dir(item):
+    st = stat_dir(item) if item else None
+    return st is not None and stat.S_ISDIR(st.st_mode)
+
+
+def is_file(item):
+    st = stat_dir(item) if item else None
+    return st is not None and stat.S_ISREG(st.st_mode)
+
+
+def readable(item):
+    if item not in _access_cache:
+        _access_cache[item] = os.access(item, os.R_OK)
+    return _access_cache[item]
+
+
+def sanitize(value, keep_empty=False, prefix='', quiet=False, files=False):
+    """liste des entrées de value sans doublons ni répertoires invalides
+
+    Avec files, les entrées désignant un fichier existant sont aussi gardées.
+    """
+    final_list = []
+    # (périphérique, inode) du répertoire ou du fichier -> première entrée qui le désigne
+    seen = {}
+    for item in value.split(':'):
+        if item == '' and keep_empty:
+            key = ''
+        elif not (is_dir(item) or (files and is_file(item))):
+            error(prefix + item + " n'existe pas", quiet)
+            continue
+        elif not readable(item):
+            error(prefix + item + " non accessible", quiet)
+            continue
+        else:
+            st = stat_dir(item)
+            key = (st.st_dev, st.st_ino)
+        if key in seen:
+            if seen[key] == item:
+                error(prefix + item + " dupliqué", quiet)
+            else:
+                error(prefix + item + " dupliqué (même %s que %s)" % ('répertoire' if is_dir(item) else 'fichier', seen[key]), quiet)
+            continue
+        seen[key] = item
         final_list.append(item)
-print(":".join(final_list))
+    return final_list
+
+
+def list_commands(directory):
+    """noms des fichiers exécutables de directory"""
+    names = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mode & 0o111:
+                        names.append(entry.name)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return names
+
+
+def scan_directories(directories, jobs=None):
+    """listes des exécutables de chaque répertoire, lus en parallèle"""
+    with ThreadPoolExecutor(max_workers=jobs or min(32, len(directories) or 1)) as executor:
+        return list(executor.map(list_commands, directories))
+
+
+def shadow_report(directories, jobs=None):
+    """(commande, chemin utilisé, [chemins masqués]) des commandes présentes dans plusieurs répertoires"""
+    listings = scan_directories(directories, jobs)
+    found = {}
+    for directory, names in zip(directories, listings):
+        for name in names:
+            found.setdefault(name, []).append(os.path.join(directory, name))
+    return [(name, paths[0], paths[1:]) for name, paths in sorted(found.items()) if len(paths) > 1]
+
+
+def command_table(directories, cache_file=HASH_CACHE, jobs=None):
+    """{commande: chemin} comme le shell les trouverait dans directories
+
+    Seuls les répertoires dont la date de modification a changé depuis
+    l'enregistrement de cache_file sont relus.
+    """
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except (IOError, OSError, ValueError):
+        cache = {}
+    mtimes = dict((directory, stat_dir(directory).st_mtime_ns) for directory in directories)
+    stale = [directory for directory in directories if cache.get(directory, {}).get('mtime') != mtimes[directory]]
+    if stale:
+        for directory, names in zip(stale, scan_directories(stale, jobs)):
+            cache[directory] = {'mtime': mtimes[directory], 'commands': names}
+        # les répertoires sortis du PATH sont oubliés
+        cache = dict((directory, cache[directory]) for directory in directories)
+        try:
+            if not os.path.isdir(os.path.dirname(cache_file)):
+                os.makedirs(os.path.dirname(cache_file))
+            with open(cache_file + '.tmp', 'w') as f:
+                json.dump(cache, f)
+            os.rename(cache_file + '.tmp', cache_file)
+        except (IOError, OSError):
+            pass
+    table = {}
+    for directory in directories:
+        for name in cache[directory]['commands']:
+            table.setdefault(name, os.path.join(directory, name))
+    return table
+
+
+def hash_commands(table, shell='zsh'):
+    """commandes `hash` du shell qui enregistrent table"""
+    lines = []
+    for name, path in sorted(table.items()):
+        if '=' in name:
+            continue
+        if shell == 'bash':
+            lines.append('hash -p %s %s' % (shlex.quote(path), shlex.quote(name)))
+        else:
+            lines.append('hash %s' % shlex.quote(name + '=' + path))
+    return lines
+
+
+def export(environ=os.environ, quiet=False):
+    """affectations shell des variables de chemins définies dans environ
+
+    Une variable non vide dont aucune entrée n'est valide est laissée telle quelle.
+    """
+    lines = []
+    for name in VARIABLES:
+        value = environ.get(name)
+        if value is None:
+            continue
+        cleaned = ':'.join(sanitize(value, name in KEEP_EMPTY, name + ': ', quiet, name in FILES_ALLOWED))
+        if value and not cleaned:
+            error(name + ": aucune entrée valide, variable inchangée", quiet)
+            continue
+        lines.append(('%s=%s' if name in NOT_EXPORTED else 'export %s=%s') % (name, shlex.quote(cleaned)))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Nettoie PATH et les autres variables de chemins.")
+    parser.add_argument('--export', action='store_true',
+                        help="affiche les affectations de %s à évaluer par le shell" % ', '.join(VARIABLES))
+    parser.add_argument('--shadow-report', action='store_true',
+                        help="liste les commandes masquées par une commande de même nom plus tôt dans le PATH")
+    parser.add_argument('--hash', action='store_true',
+                        help="affiche les commandes `hash` remplissant la table des commandes du shell")
+    parser.add_argument('--shell', choices=['zsh', 'bash'], default='zsh', help="syntaxe des commandes de --hash (défaut : zsh)")
+    parser.add_argument('--cache', default=HASH_CACHE, help="fichier des listes de commandes de --hash (défaut : %(default)s)")
+    parser.add_argument('-j', '--jobs', type=int, help="nombre de répertoires lus en parallèle")
+    parser.add_argument('-q', '--quiet', action='store_true', help="ne signale pas les entrées retirées")
+    args = parser.parse_args(argv)
+
+    if args.shadow_report:
+        for name, used, shadowed in shadow_report(sanitize(os.getenv('PATH', ''), quiet=args.quiet), args.jobs):
+            print('%s\t%s\t%s' % (name, used, ' '.join(shadowed)))
+    elif args.export or args.hash:
+        lines = export(quiet=args.quiet) if args.export else []
+        if args.hash:
+            directories = sanitize(os.getenv('PATH', ''), quiet=args.export or args.quiet)
+            lines.extend(hash_commands(command_table(directories, args.cache, args.jobs), args.shell))
+        for line in lines:
+            print(line)
+    else:
+        print(":".join(sanitize(os.getenv('PATH', ''), quiet=args.quiet)))
+    return 0
+
 
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,19 +4,28 @@
 from __future__ import annotations
 
 import argparse
+import io
 import json
 import os
 import re
 import shutil
 import subprocess
 import sys
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Callable, Dict, List, Optional, Sequence
+from typing import Callable, Dict, List, Optional, Sequence, TextIO
 
 MODULE_ORDER = ["docker", "gh", "git", "shell", "libsecret", "extra"]
 
+# Modules that must finish before another one starts when running with --jobs
+MODULE_DEPENDENCIES = {
+    # both handle ~/.gitconfig.local
+    "extra": ["git"],
+}
+
 EXTRA_RM_PATHS = [
     "~/.gitconfig.local",
     "~/.local/share/marks/marks.sqlite",
@@ -37,11 +46,18 @@ LIBSECRET_CLEAR_RULES = [
 
 NETRC_HOST_PREFIXES = ("github.", "gitlab.", "bitbucket.")
 
+# Lines of `gh auth status` about one account, old and new gh releases
+GH_LOGGED_IN_RE = re.compile(r"Logged in to (\S+)")
+GH_FAILED_RE = re.compile(r"Failed to log in to (\S+)|(\S+): authentication failed")
+
 HOME = Path.home()
 SHRED = shutil.which("shred")
 
 _sections_printed = 0
 
+# Per-thread output buffer of the module being run with --jobs
+_local = threading.local()
+
 
 class Palette:
     def __init__(self, enabled: bool) -> None:
@@ -66,30 +82,34 @@ class Palette:
 palette = Palette(False)
 
 
+def output() -> TextIO:
+    return getattr(_local, "buffer", None) or sys.stderr
+
+
 def log(message: str = "") -> None:
-    print(message, file=sys.stderr)
+    print(message, file=output())
 
 
 def info(message: str) -> None:
-    print(f"{palette.info}[INFO]{palette.reset} {message}", file=sys.stderr)
+    print(f"{palette.info}[INFO]{palette.reset} {message}", file=output())
 
 
 def ok(message: str) -> None:
-    print(f"{palette.ok}[ OK ]{palette.reset} {message}", file=sys.stderr)
+    print(f"{palette.ok}[ OK ]{palette.reset} {message}", file=output())
 
 
 def warn(message: str) -> None:
-    print(f"{palette.warn}[WARN]{palette.reset} {message}", file=sys.stderr)
+    print(f"{palette.warn}[WARN]{palette.reset} {message}", file=output())
 
 
 def error(message: str) -> None:
-    print(f"{palette.error}[ERR ]{palette.reset} {message}", file=sys.stderr)
+    print(f"{palette.error}[ERR ]{palette.reset} {message}", file=output())
 
 
 def section(title: str) -> None:
     global _sections_printed
     prefix = "\n" if _sections_printed else ""
-    print(f"{prefix}{palette.header}{palette.bold}== {title} =={palette.reset}", file=sys.stderr)
+    print(f"{prefix}{palette.header}{palette.bold}== {title} =={palette.reset}", file=output())
     _sections_printed += 1
 
 
@@ -103,8 +123,14 @@ def run(
     capture_output: bool = False,
     check: bool = False,
 ) -> Optional[subprocess.CompletedProcess]:
+    buffer = getattr(_local, "buffer", None)
     try:
-        return subprocess.run(cmd, check=check, capture_output=capture_output, text=True)
+        if buffer is None or capture_output:
+            return subprocess.run(cmd, check=check, capture_output=capture_output, text=True)
+        # keep the output of the command with the log lines of its module
+        proc = subprocess.run(cmd, check=check, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        buffer.write(proc.stdout or "")
+        return proc
     except FileNotFoundError:
         return None
     except Exception as exc:
@@ -247,40 +273,58 @@ def gh_hosts() -> List[str]:
     return sorted(dict.fromkeys(hosts))
 
 
+def gh_auth_status() -> Optional[Dict[str, bool]]:
+    """Hosts gh holds a token for, mapped to whether it is valid, from a single `gh auth status`.
+
+    Returns None when gh cannot be run.
+    """
+    if not command_exists("gh"):
+        return None
+    proc = run(["gh", "auth", "status"], capture_output=True)
+    if proc is None:
+        return None
+    status: Dict[str, bool] = {}
+    # depending on the release, the report goes to stdout or stderr
+    for line in (proc.stdout + proc.stderr).splitlines():
+        match = GH_LOGGED_IN_RE.search(line)
+        if match:
+            status[match.group(1)] = True
+            continue
+        match = GH_FAILED_RE.search(line)
+        if match:
+            status.setdefault(match.group(1) or match.group(2), False)
+    return status
+
+
 def gh_audit() -> None:
     hosts_file = HOME / ".config" / "gh" / "hosts.yml"
     if hosts_file.exists():
         info(f"gh hosts file found at {hosts_file}")
     else:
         ok("gh: no hosts.yml file")
-    hosts = gh_hosts()
-    if "github.com" not in hosts:
-        hosts.append("github.com")
-    hosts = sorted(dict.fromkeys(hosts))
-    if not hosts:
-        ok("gh: no known hosts to inspect")
-        return
     if not command_exists("gh"):
         warn("gh CLI not available; skipping authentication status checks")
         return
+    status = gh_auth_status() or {}
+    hosts = sorted(set(gh_hosts()) | set(status) | {"github.com"})
     for host in hosts:
-        proc = run(["gh", "auth", "status", "-h", host])
-        if proc and proc.returncode == 0:
+        if status.get(host):
             warn(f"gh authenticated against {host}")
+        elif host in status:
+            warn(f"gh holds a token for {host} that cannot be validated")
         else:
             ok(f"gh not authenticated against {host}")
 
 
 def gh_clean() -> None:
-    hosts = gh_hosts()
-    if "github.com" not in hosts:
-        hosts.append("github.com")
-    hosts = list(dict.fromkeys(hosts))
-    if hosts and command_exists("gh"):
+    # every host of hosts.yml is logged out, whatever `gh auth status` makes of it
+    # (offline, new output format): a token left in the keyring must not survive
+    hosts = list(dict.fromkeys(gh_hosts() + ["github.com"]))
+    if command_exists("gh"):
         for host in hosts:
             info(f"gh auth logout -h {host}")
             run(["gh", "auth", "logout", "-h", host, "--hostname", host, "--confirm"])
-    elif hosts:
+    else:
         warn("gh CLI not available; cannot logout hosts")
     hosts_file = HOME / ".config" / "gh" / "hosts.yml"
     if hosts_file.exists():
@@ -491,14 +535,14 @@ def final_checks() -> None:
             ok("Docker: config.json clean")
     else:
         ok("Docker: no config.json file")
-    if command_exists("gh"):
-        proc = run(["gh", "auth", "status", "-h", "github.com"])
-        if proc and proc.returncode == 0:
-            warn("gh: still authenticated with github.com")
-        else:
-            ok("gh: not authenticated with github.com")
-    else:
+    status = gh_auth_status()
+    if status is None:
         warn("gh CLI not available; skipped status check")
+    elif any(status.values()):
+        for host in sorted(host for host, valid in status.items() if valid):
+            warn(f"gh: still authenticated with {host}")
+    else:
+        ok("gh: not authenticated with any host")
     if command_exists("git"):
         proc = run(["git", "config", "--global", "--get-all", "credential.helper"], capture_output=True)
         helpers = []
@@ -589,6 +633,13 @@ def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
         help="Comma separated list of modules to skip",
         metavar="MODULES",
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of modules run concurrently, their output is printed module by module (default: 1)",
+        metavar="N",
+    )
     parser.add_argument(
         "--no-color",
         action="store_true",
@@ -615,6 +666,42 @@ def select_modules(only: Optional[List[str]], skip: Optional[List[str]]) -> List
     return selected
 
 
+def run_module(name: str, mode: str) -> None:
+    module = MODULES[name]
+    section(f"{module.name.upper()} ({mode.upper()})")
+    handler = module.audit if mode == "audit" else module.clean
+    try:
+        handler()
+    except KeyboardInterrupt:
+        raise
+    except Exception as exc:
+        error(f"{module.name}: {exc}")
+
+
+def run_buffered(name: str, mode: str, dependencies: Sequence[Future]) -> str:
+    for dependency in dependencies:
+        dependency.result()
+    _local.buffer = io.StringIO()
+    try:
+        run_module(name, mode)
+        return _local.buffer.getvalue()
+    finally:
+        _local.buffer = None
+
+
+def run_concurrently(selected: List[str], mode: str, jobs: int) -> None:
+    """Run the modules in a pool of jobs threads, printing their output in the order of selected."""
+    futures: Dict[str, Future] = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # dependencies come first in MODULE_ORDER, so they are always started before their dependents
+        for name in sorted(selected, key=MODULE_ORDER.index):
+            dependencies = [futures[dep] for dep in MODULE_DEPENDENCIES.get(name, []) if dep in futures]
+            futures[name] = executor.submit(run_buffered, name, mode, dependencies)
+        for name in selected:
+            sys.stderr.write(futures[name].result())
+            sys.stderr.flush()
+
+
 def list_modules() -> None:
     for name in MODULE_ORDER:
         module = MODULES[name]
@@ -639,16 +726,11 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
         log("No change will be applied.")
     else:
         log("Cleanup actions will be applied.")
-    for name in selected:
-        module = MODULES[name]
-        section(f"{module.name.upper()} ({args.mode.upper()})")
-        handler = module.audit if args.mode == "audit" else module.clean
-        try:
-            handler()
-        except KeyboardInterrupt:
-            raise
-        except Exception as exc:
-            error(f"{module.name}: {exc}")
+    if args.jobs > 1:
+        run_concurrently(selected, args.mode, args.jobs)
+    else:
+        for name in selected:
+            run_module(name, args.mode)
     final_checks()
     return 0
 